@@ -1,31 +1,80 @@
 import asyncio
+import base64
+import csv
+import hmac
+import io
 import json
 import logging
+import multiprocessing
 import os
+import pickle
+import queue
 import re
 import sqlite3
 import threading
 import time
-from datetime import datetime, timedelta, timezone
+import uuid
+import zipfile
+import zlib
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager, suppress
+from datetime import date, datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from hashlib import sha256
+from urllib.parse import quote
 
+import click
 import httpx
+import numpy as np
+import openpyxl
 import pandas as pd
-from flask import Flask, jsonify, redirect, render_template, request, send_file, session
+from flask import (
+    Flask,
+    Response,
+    g,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    send_file,
+    session,
+    stream_with_context,
+)
 from werkzeug.utils import secure_filename
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.environ.get("DATA_DIR", "/data")
 DB_PATH = os.path.join(DATA_DIR, "crm.db")
 UPLOAD_DIR = os.path.join(DATA_DIR, "uploads")
+EXPORT_DIR = os.path.join(DATA_DIR, "exports")
+EXPORT_CACHE_DIR = os.path.join(DATA_DIR, "export_cache")
+EXPORT_CACHE_MAX_MB = int(os.environ.get("EXPORT_CACHE_MAX_MB", "500"))
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("APP_SECRET", "dev-secret")
-app.config["MAX_CONTENT_LENGTH"] = 20 * 1024 * 1024
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_MB", "200")) * 1024 * 1024
 app.config["UPLOAD_DIR"] = UPLOAD_DIR
 
 logger = logging.getLogger(__name__)
 
+
+class RedactWebhookTokenFilter(logging.Filter):
+    pattern = re.compile(r"(/api/cdek/webhook\S*?[?&]token=)[^&\s\"]+")
+
+    def filter(self, record):
+        message = record.getMessage()
+        redacted = self.pattern.sub(r"\1***", message)
+        if redacted != message:
+            record.msg, record.args = redacted, ()
+        return True
+
+
+for access_logger in ("werkzeug", "gunicorn.access"):
+    logging.getLogger(access_logger).addFilter(RedactWebhookTokenFilter())
+
 PASSWORD = os.environ.get("APP_PASSWORD", "admin")
 ADMIN_LOGIN = os.environ.get("APP_ADMIN_LOGIN", "admin")
 ROLE_ADMIN = "admin"
@@ -96,15 +145,668 @@ def require_page_access(page_key, redirect_on_fail=True):
     return jsonify({"error": "forbidden"}), 403
 
 
+def normalize_product_key(value):
+    if value is None:
+        return None
+    return " ".join(str(value).split()).casefold()
+
+
+SQLITE_POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", "16"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "32768"))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+
+class ConnectionPool:
+    def __init__(self, path, size=SQLITE_POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.create_function("product_key", 1, normalize_product_key, deterministic=True)
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _release(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        current = getattr(self._local, "conn", None)
+        if current is not None:
+            yield current
+            return
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+db_pool = ConnectionPool(DB_PATH)
+
+
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db_pool.connection()
+
+
+RECORDS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        location_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        stock INTEGER,
+        sales_qty INTEGER,
+        sales_amount REAL,
+        record_date TEXT,
+        source_file TEXT,
+        created_at TEXT NOT NULL,
+        import_job_id INTEGER,
+        batch_id INTEGER,
+        sales_date TEXT,
+        FOREIGN KEY(location_id) REFERENCES locations(id),
+        FOREIGN KEY(product_id) REFERENCES products(id)
+    )
+"""
+CURRENT_STOCK_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS current_stock (
+        location_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        stock INTEGER NOT NULL,
+        batch_id INTEGER NOT NULL,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (location_id, product_id)
+    ) WITHOUT ROWID
+"""
+
+
+def get_table_columns(conn, table):
+    return {row["name"] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def ensure_column(conn, table, column, definition):
+    if column not in get_table_columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def migrate_legacy_columns(conn):
+    columns = get_table_columns(conn, "shipments")
+    if "track_number" in columns and "internal_number" not in columns:
+        conn.execute("ALTER TABLE shipments RENAME COLUMN track_number TO internal_number")
+    for column in ["internal_number", "display_number", "cdek_number", "cdek_uuid", "cdek_state"]:
+        ensure_column(conn, "shipments", column, "TEXT")
+    ensure_column(conn, "records", "import_job_id", "INTEGER")
+    ensure_column(conn, "employees", "login", "TEXT")
+    ensure_column(conn, "profiles", "avatar_url", "TEXT")
+    ensure_column(conn, "profiles", "xp", "INTEGER NOT NULL DEFAULT 0")
+    ensure_column(conn, "profiles", "updated_at", "TEXT")
+    conn.execute(
+        """
+        UPDATE employees
+        SET login = name
+        WHERE login IS NULL OR TRIM(login) = ''
+        """
+    )
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_employees_login ON employees(login)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_course_access_login ON course_access(login)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_course_progress_login ON course_progress(login)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_records_import_job ON records(import_job_id)")
+    rebuild_location_totals(conn)
+
+
+def migrate_hot_query_indexes(conn):
+    indexes = {
+        "idx_records_location_created": "records(location_id, created_at)",
+        "idx_blogger_integrations_blogger": "blogger_integrations(blogger_id)",
+        "idx_tasks_updated": "tasks(updated_at)",
+        "idx_knowledge_items_updated": "knowledge_items(updated_at)",
+        "idx_shipments_created": "shipments(created_at)",
+        "idx_locations_created": "locations(created_at)",
+        "idx_bloggers_created": "bloggers(created_at)",
+        "idx_employees_created": "employees(created_at)",
+        "idx_courses_created": "courses(created_at)",
+        "idx_course_badges_login": "course_badges(login, awarded_at)",
+        "idx_import_jobs_location": "import_jobs(location_id, id)",
+    }
+    for name, target in indexes.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
+
+def migrate_cdek_poll_schedule(conn):
+    ensure_column(conn, "shipments", "status_changed_at", "TEXT")
+    ensure_column(conn, "shipments", "next_poll_at", "TEXT")
+    now = datetime.utcnow().isoformat()
+    terminal = ", ".join("?" for _ in CDEK_TERMINAL_STATES)
+    conn.execute(
+        f"""
+        UPDATE shipments
+        SET status_changed_at = ?,
+            next_poll_at = CASE
+                WHEN UPPER(COALESCE(cdek_state, '')) IN ({terminal}) THEN NULL
+                ELSE ?
+            END
+        WHERE cdek_number IS NOT NULL
+        """,
+        (now, *CDEK_TERMINAL_STATES, now),
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_shipments_next_poll ON shipments(next_poll_at)"
+    )
+
+
+def migrate_cdek_webhook_lookup(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_shipments_cdek_number ON shipments(cdek_number)")
+
+
+def migrate_compact_status_history(conn):
+    kind = conn.execute(
+        "SELECT type FROM sqlite_master WHERE name = 'shipment_status_history'"
+    ).fetchone()
+    if kind and kind["type"] == "table":
+        legacy_history = {}
+        for row in conn.execute("SELECT * FROM shipment_status_history ORDER BY id"):
+            item = dict(row)
+            # Legacy rows often carry only the Russian name; store the CDEK code
+            # so later polls of the same event dedupe against it.
+            item["status_code"] = item.get("status_code") or CDEK_STATUS_CODES_BY_NAME.get(
+                item.get("status")
+            )
+            legacy_history.setdefault(row["shipment_id"], []).append(item)
+        for shipment_id, items in legacy_history.items():
+            record_cdek_status_history(conn, shipment_id, items)
+        conn.execute("DROP TABLE shipment_status_history")
+    conn.execute(
+        """
+        CREATE VIEW IF NOT EXISTS shipment_status_history AS
+        SELECT events.shipment_id AS shipment_id,
+               codes.name AS status,
+               locations.name AS location,
+               codes.code AS status_code,
+               events.timestamp AS timestamp
+        FROM shipment_status_events AS events
+        JOIN cdek_status_codes AS codes ON codes.id = events.status_id
+        LEFT JOIN cdek_locations AS locations ON locations.id = events.location_id
+        """
+    )
+
+
+REVISIONED_TABLES = {
+    "locations": None,
+    "location_totals": None,
+    "shipments": [
+        "origin_label",
+        "destination_label",
+        "internal_number",
+        "display_number",
+        "cdek_state",
+        "last_status",
+        "last_location",
+        "last_update",
+    ],
+    "tasks": None,
+    "knowledge_items": None,
+    "bloggers": None,
+    "profiles": None,
+    "courses": None,
+    "course_access": None,
+    "course_progress": None,
+    "course_badges": None,
+}
+
+
+def migrate_table_revision_triggers(conn):
+    now = datetime.utcnow().isoformat()
+    conn.executemany(
+        "INSERT OR IGNORE INTO table_revisions (table_name, revision, updated_at) VALUES (?, 0, ?)",
+        [(table, now) for table in REVISIONED_TABLES],
+    )
+    for table, visible_columns in REVISIONED_TABLES.items():
+        for operation in ["INSERT", "UPDATE", "DELETE"]:
+            event = operation
+            if operation == "UPDATE" and visible_columns:
+                event = f"UPDATE OF {', '.join(visible_columns)}"
+            conn.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_revision_{operation.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_revisions
+                    SET revision = revision + 1,
+                        updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now')
+                    WHERE table_name = '{table}';
+                END
+                """
+            )
+
+
+SYNCED_TABLES = ["tasks", "knowledge_items"]
+
+
+def migrate_sync_log(conn):
+    for table in SYNCED_TABLES:
+        conn.execute(
+            f"""
+            INSERT OR REPLACE INTO sync_log (table_name, row_id, deleted)
+            SELECT ?, id, 0 FROM {table} ORDER BY updated_at, id
+            """,
+            (table,),
+        )
+        for operation, row, deleted in [
+            ("INSERT", "NEW", 0),
+            ("UPDATE", "NEW", 0),
+            ("DELETE", "OLD", 1),
+        ]:
+            conn.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_sync_{operation.lower()}
+                AFTER {operation} ON {table}
+                BEGIN
+                    INSERT OR REPLACE INTO sync_log (table_name, row_id, deleted)
+                    VALUES ('{table}', {row}.id, {deleted});
+                END
+                """
+            )
+
+
+def migrate_records_browse_indexes(conn):
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_records_location_source
+        ON records(location_id, source_file, created_at)
+        """
+    )
+
+
+def migrate_import_batches(conn):
+    ensure_column(conn, "records", "batch_id", "INTEGER")
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_import_batches_location
+        ON import_batches(location_id, created_at)
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO import_batches (location_id, source_file, import_job_id, row_count, created_at)
+        SELECT location_id, source_file, MAX(import_job_id), COUNT(*), created_at
+        FROM records
+        WHERE batch_id IS NULL
+        GROUP BY location_id, source_file, created_at
+        ORDER BY created_at, location_id
+        """
+    )
+    conn.execute(
+        """
+        UPDATE records
+        SET batch_id = (
+            SELECT id FROM import_batches AS batches
+            WHERE batches.location_id = records.location_id
+              AND batches.created_at = records.created_at
+              AND batches.source_file IS records.source_file
+        )
+        WHERE batch_id IS NULL
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_records_batch ON records(batch_id)")
+
+
+def migrate_products_dimension(conn):
+    if "product" in get_table_columns(conn, "records"):
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO products (product_key, display_name, name, created_at)
+            SELECT product_key(product), product, product, MIN(created_at)
+            FROM records
+            GROUP BY product
+            ORDER BY MIN(id)
+            """
+        )
+        conn.execute("DROP TABLE IF EXISTS records_migrated")
+        conn.execute(RECORDS_TABLE_SQL.format(table="records_migrated"))
+        conn.execute(
+            """
+            INSERT INTO records_migrated
+            (id, location_id, product_id, stock, sales_qty, sales_amount, record_date,
+             source_file, created_at, import_job_id, batch_id)
+            SELECT records.id, records.location_id, products.id, records.stock,
+                   records.sales_qty, records.sales_amount, records.record_date,
+                   records.source_file, records.created_at, records.import_job_id,
+                   records.batch_id
+            FROM records
+            JOIN products ON products.product_key = product_key(records.product)
+            ORDER BY records.id
+            """
+        )
+        conn.execute("DROP TABLE records")
+        conn.execute("ALTER TABLE records_migrated RENAME TO records")
+    if "product" in get_table_columns(conn, "current_stock"):
+        conn.execute("DROP TABLE current_stock")
+        conn.execute(CURRENT_STOCK_TABLE_SQL)
+    indexes = {
+        "idx_records_location_created": "records(location_id, created_at)",
+        "idx_records_import_job": "records(import_job_id)",
+        "idx_records_location_source": "records(location_id, source_file, created_at)",
+        "idx_records_batch": "records(batch_id)",
+        "idx_records_product": "records(product_id, location_id)",
+    }
+    for name, target in indexes.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+    rebuild_current_stock(conn)
+    rebuild_location_totals(conn)
+
+
+def migrate_sales_rollups(conn):
+    ensure_column(conn, "records", "sales_date", "TEXT")
+    conn.execute(
+        f"""
+        UPDATE records SET sales_date = {SALES_DATE_SQL}
+        WHERE sales_date IS NULL
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_sales_rollups_location
+        ON sales_rollups(grain, location_id, period)
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_sales_rollups_product
+        ON sales_rollups(grain, product_id, period)
+        """
+    )
+    rebuild_sales_rollups(conn)
+
+
+def migrate_import_hashes(conn):
+    ensure_column(conn, "import_batches", "content_sha256", "TEXT")
+    ensure_column(conn, "import_jobs", "content_sha256", "TEXT")
+    ensure_column(conn, "import_jobs", "skipped_rows", "INTEGER NOT NULL DEFAULT 0")
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_import_batches_hash
+        ON import_batches(location_id, content_sha256)
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_import_jobs_hash
+        ON import_jobs(location_id, content_sha256)
+        """
+    )
+
+
+def migrate_sales_dates_fix(conn):
+    changed = conn.execute(
+        f"""
+        UPDATE records SET sales_date = {SALES_DATE_SQL}
+        WHERE sales_date IS NOT {SALES_DATE_SQL}
+        """
+    ).rowcount
+    if changed:
+        rebuild_sales_rollups(conn)
+
+
+def migrate_legacy_status_codes(conn):
+    for code, name in CDEK_STATUS_NAMES.items():
+        legacy = conn.execute(
+            "SELECT id FROM cdek_status_codes WHERE code = ?", (name,)
+        ).fetchone()
+        if not legacy:
+            continue
+        conn.execute(
+            "INSERT OR IGNORE INTO cdek_status_codes (code, name) VALUES (?, ?)", (code, name)
+        )
+        status_id = conn.execute(
+            "SELECT id FROM cdek_status_codes WHERE code = ?", (code,)
+        ).fetchone()["id"]
+        conn.execute(
+            "UPDATE OR IGNORE shipment_status_events SET status_id = ? WHERE status_id = ?",
+            (status_id, legacy["id"]),
+        )
+        conn.execute("DELETE FROM shipment_status_events WHERE status_id = ?", (legacy["id"],))
+        conn.execute("DELETE FROM cdek_status_codes WHERE id = ?", (legacy["id"],))
+
+
+def migrate_resume_not_delivered(conn):
+    conn.execute(
+        """
+        UPDATE shipments SET next_poll_at = ?
+        WHERE UPPER(cdek_state) = 'NOT_DELIVERED'
+          AND next_poll_at IS NULL AND cdek_number IS NOT NULL
+        """,
+        (datetime.utcnow().isoformat(),),
+    )
+
+
+def migrate_import_job_owner(conn):
+    ensure_column(conn, "import_jobs", "worker_pid", "INTEGER")
+
+
+MIGRATIONS = [
+    (1, migrate_legacy_columns),
+    (2, migrate_hot_query_indexes),
+    (3, migrate_cdek_poll_schedule),
+    (4, migrate_cdek_webhook_lookup),
+    (5, migrate_compact_status_history),
+    (6, migrate_table_revision_triggers),
+    (7, migrate_sync_log),
+    (8, migrate_records_browse_indexes),
+    (9, migrate_import_batches),
+    (10, migrate_products_dimension),
+    (11, migrate_sales_rollups),
+    (12, migrate_import_hashes),
+    (13, migrate_import_job_owner),
+    (14, migrate_sales_dates_fix),
+    (15, migrate_legacy_status_codes),
+    (16, migrate_resume_not_delivered),
+]
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn):
+    version = get_schema_version(conn)
+    for number, migration in MIGRATIONS:
+        if number <= version:
+            continue
+        logger.info("Applying database migration %s (%s).", number, migration.__name__)
+        migration(conn)
+        conn.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+
+
+HOT_QUERIES = {
+    "locations_dashboard": (
+        """
+        SELECT l.id, l.name, l.address, t.total_stock, t.last_update
+        FROM locations l
+        LEFT JOIN location_totals t ON t.location_id = l.id
+        ORDER BY l.created_at DESC
+        """,
+        (),
+    ),
+    "records_by_location": (
+        "SELECT * FROM records WHERE location_id = ? ORDER BY created_at DESC",
+        (1,),
+    ),
+    "records_page": (
+        """
+        SELECT * FROM records
+        WHERE location_id = ? AND (created_at, id) < (?, ?)
+        ORDER BY created_at DESC, id DESC
+        LIMIT 101
+        """,
+        (1, "9999", 0),
+    ),
+    "records_by_product": (
+        """
+        SELECT records.* FROM products
+        CROSS JOIN records ON records.product_id = products.id
+        WHERE records.location_id = ? AND (products.product_key, records.id) > (?, ?)
+        ORDER BY products.product_key, records.id
+        LIMIT 101
+        """,
+        (1, "", 0),
+    ),
+    "product_across_locations": (
+        "SELECT location_id, SUM(sales_qty) FROM records WHERE product_id = ? GROUP BY location_id",
+        (1,),
+    ),
+    "sales_by_location_period": (
+        """
+        SELECT period, SUM(sales_qty), SUM(sales_amount) FROM sales_rollups
+        WHERE grain = ? AND location_id = ? AND period BETWEEN ? AND ?
+        GROUP BY period
+        ORDER BY period
+        """,
+        ("week", 1, "2024-01-01", "2024-12-31"),
+    ),
+    "sales_by_product_period": (
+        """
+        SELECT period, SUM(sales_qty), SUM(sales_amount) FROM sales_rollups
+        WHERE grain = ? AND product_id = ? AND period BETWEEN ? AND ?
+        GROUP BY period
+        ORDER BY period
+        """,
+        ("month", 1, "2024-01-01", "2024-12-31"),
+    ),
+    "records_export_all": (
+        """
+        SELECT records.* FROM records
+        JOIN locations ON locations.id = records.location_id
+        ORDER BY records.location_id DESC, records.created_at DESC
+        """,
+        (),
+    ),
+    "records_by_source_file": (
+        """
+        SELECT * FROM records
+        WHERE location_id = ? AND source_file = ?
+        ORDER BY created_at DESC, id DESC
+        LIMIT 101
+        """,
+        (1, "file.xlsx"),
+    ),
+    "shipments_list": ("SELECT * FROM shipments ORDER BY created_at DESC", ()),
+    "shipment_history": (
+        """
+        SELECT * FROM shipment_status_history
+        WHERE shipment_id = ?
+        ORDER BY timestamp DESC
+        """,
+        (1,),
+    ),
+    "shipments_due": (
+        """
+        SELECT * FROM shipments
+        WHERE next_poll_at IS NOT NULL AND next_poll_at <= ?
+        ORDER BY next_poll_at
+        LIMIT 500
+        """,
+        ("2024-01-01T00:00:00",),
+    ),
+    "tasks_list": ("SELECT * FROM tasks ORDER BY updated_at DESC", ()),
+    "knowledge_list": ("SELECT * FROM knowledge_items ORDER BY updated_at DESC", ()),
+    "bloggers_list": ("SELECT * FROM bloggers ORDER BY created_at DESC", ()),
+    "blogger_integrations": (
+        "SELECT * FROM blogger_integrations WHERE blogger_id = ?",
+        (1,),
+    ),
+    "employees_list": ("SELECT * FROM employees ORDER BY created_at DESC", ()),
+    "courses_list": ("SELECT * FROM courses ORDER BY created_at DESC", ()),
+    "course_badges_by_login": (
+        """
+        SELECT * FROM course_badges
+        WHERE login = ?
+        ORDER BY awarded_at DESC
+        """,
+        ("admin",),
+    ),
+    "import_jobs_by_location": (
+        "SELECT * FROM import_jobs WHERE location_id = ? ORDER BY id DESC LIMIT 50",
+        (1,),
+    ),
+}
+
+
+def explain_hot_queries(conn):
+    report = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = [
+            row["detail"]
+            for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        ]
+        warnings = []
+        for detail in plan:
+            if detail.startswith("SCAN") and "INDEX" not in detail:
+                warnings.append(f"full scan: {detail}")
+            if "TEMP B-TREE" in detail:
+                warnings.append(f"sort without index: {detail}")
+        report.append({"name": name, "plan": plan, "warnings": warnings})
+    return report
+
+
+@app.cli.command("explain-queries")
+def explain_queries_command():
+    init_db()
+    with get_db() as conn:
+        click.echo(f"Schema version: {get_schema_version(conn)}")
+        report = explain_hot_queries(conn)
+    flagged = 0
+    for entry in report:
+        status = "WARN" if entry["warnings"] else "ok"
+        click.echo(f"[{status}] {entry['name']}")
+        for detail in entry["plan"]:
+            click.echo(f"    {detail}")
+        for warning in entry["warnings"]:
+            click.echo(f"    ! {warning}")
+        flagged += bool(entry["warnings"])
+    if flagged:
+        raise SystemExit(1)
 
 
 def init_db():
     os.makedirs(DATA_DIR, exist_ok=True)
     os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
     with get_db() as conn:
         conn.execute(
             """
@@ -116,18 +818,79 @@ def init_db():
             )
             """
         )
+        conn.execute(RECORDS_TABLE_SQL.format(table="records"))
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS products (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_key TEXT NOT NULL UNIQUE,
+                display_name TEXT NOT NULL,
+                brand TEXT,
+                name TEXT,
+                characteristic TEXT,
+                created_at TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS location_totals (
+                location_id INTEGER PRIMARY KEY,
+                total_stock INTEGER NOT NULL DEFAULT 0,
+                total_sales_qty INTEGER NOT NULL DEFAULT 0,
+                total_sales_amount REAL NOT NULL DEFAULT 0,
+                record_count INTEGER NOT NULL DEFAULT 0,
+                last_update TEXT,
+                FOREIGN KEY(location_id) REFERENCES locations(id)
+            )
+            """
+        )
         conn.execute(
             """
-            CREATE TABLE IF NOT EXISTS records (
+            CREATE TABLE IF NOT EXISTS import_batches (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 location_id INTEGER NOT NULL,
-                product TEXT NOT NULL,
-                stock INTEGER,
-                sales_qty INTEGER,
-                sales_amount REAL,
-                record_date TEXT,
                 source_file TEXT,
+                import_job_id INTEGER,
+                row_count INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                content_sha256 TEXT,
+                FOREIGN KEY(location_id) REFERENCES locations(id)
+            )
+            """
+        )
+        conn.execute(CURRENT_STOCK_TABLE_SQL)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sales_rollups (
+                grain TEXT NOT NULL,
+                period TEXT NOT NULL,
+                location_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                sales_qty INTEGER NOT NULL DEFAULT 0,
+                sales_amount REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (grain, period, location_id, product_id)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS import_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                location_id INTEGER NOT NULL,
+                filename TEXT NOT NULL,
+                path TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'queued',
+                rows INTEGER NOT NULL DEFAULT 0,
+                progress REAL NOT NULL DEFAULT 0,
+                error TEXT,
+                created_by_login TEXT,
                 created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                content_sha256 TEXT,
+                skipped_rows INTEGER NOT NULL DEFAULT 0,
+                worker_pid INTEGER,
                 FOREIGN KEY(location_id) REFERENCES locations(id)
             )
             """
@@ -146,20 +909,99 @@ def init_db():
                 last_status TEXT,
                 last_location TEXT,
                 last_update TEXT,
+                status_changed_at TEXT,
+                next_poll_at TEXT,
                 created_at TEXT NOT NULL
             )
             """
         )
         conn.execute(
             """
-            CREATE TABLE IF NOT EXISTS shipment_status_history (
+            CREATE TABLE IF NOT EXISTS cdek_tokens (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                client_id TEXT,
+                access_token TEXT,
+                expires_at TEXT,
+                refresh_owner TEXT,
+                refresh_lease_until TEXT,
+                updated_at TEXT
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS table_revisions (
+                table_name TEXT PRIMARY KEY,
+                revision INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sync_log (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                row_id INTEGER NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (table_name, row_id)
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_sync_log_table_seq ON sync_log(table_name, seq)"
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS change_events (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                action TEXT NOT NULL,
+                entity_id INTEGER,
+                payload TEXT,
+                created_at TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_change_events_created ON change_events(created_at)"
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cdek_status_codes (
+                id INTEGER PRIMARY KEY,
+                code TEXT NOT NULL UNIQUE,
+                name TEXT
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cdek_locations (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS shipment_status_events (
                 shipment_id INTEGER NOT NULL,
-                status TEXT,
-                location TEXT,
+                timestamp TEXT NOT NULL,
+                status_id INTEGER NOT NULL,
+                location_id INTEGER,
+                PRIMARY KEY (shipment_id, timestamp, status_id)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cdek_webhook_events (
+                event_key TEXT PRIMARY KEY,
+                cdek_number TEXT NOT NULL,
                 status_code TEXT,
-                timestamp TEXT,
-                FOREIGN KEY(shipment_id) REFERENCES shipments(id)
+                status_timestamp TEXT,
+                received_at TEXT NOT NULL
             )
             """
         )
@@ -308,53 +1150,7 @@ def init_db():
             )
             """
         )
-        columns = {
-            row["name"] for row in conn.execute("PRAGMA table_info(shipments)").fetchall()
-        }
-        if "track_number" in columns and "internal_number" not in columns:
-            conn.execute("ALTER TABLE shipments RENAME COLUMN track_number TO internal_number")
-            columns.discard("track_number")
-            columns.add("internal_number")
-        if "internal_number" not in columns:
-            conn.execute("ALTER TABLE shipments ADD COLUMN internal_number TEXT")
-        if "display_number" not in columns:
-            conn.execute("ALTER TABLE shipments ADD COLUMN display_number TEXT")
-        if "cdek_number" not in columns:
-            conn.execute("ALTER TABLE shipments ADD COLUMN cdek_number TEXT")
-        if "cdek_uuid" not in columns:
-            conn.execute("ALTER TABLE shipments ADD COLUMN cdek_uuid TEXT")
-        if "cdek_state" not in columns:
-            conn.execute("ALTER TABLE shipments ADD COLUMN cdek_state TEXT")
-        employee_columns = {
-            row["name"] for row in conn.execute("PRAGMA table_info(employees)").fetchall()
-        }
-        if "login" not in employee_columns:
-            conn.execute("ALTER TABLE employees ADD COLUMN login TEXT")
-        profile_columns = {
-            row["name"] for row in conn.execute("PRAGMA table_info(profiles)").fetchall()
-        }
-        if "avatar_url" not in profile_columns:
-            conn.execute("ALTER TABLE profiles ADD COLUMN avatar_url TEXT")
-        if "xp" not in profile_columns:
-            conn.execute("ALTER TABLE profiles ADD COLUMN xp INTEGER NOT NULL DEFAULT 0")
-        if "updated_at" not in profile_columns:
-            conn.execute("ALTER TABLE profiles ADD COLUMN updated_at TEXT")
-        conn.execute(
-            """
-            UPDATE employees
-            SET login = name
-            WHERE login IS NULL OR TRIM(login) = ''
-            """
-        )
-        conn.execute(
-            "CREATE UNIQUE INDEX IF NOT EXISTS idx_employees_login ON employees(login)"
-        )
-        conn.execute(
-            "CREATE INDEX IF NOT EXISTS idx_course_access_login ON course_access(login)"
-        )
-        conn.execute(
-            "CREATE INDEX IF NOT EXISTS idx_course_progress_login ON course_progress(login)"
-        )
+        apply_migrations(conn)
         employee_ids = conn.execute("SELECT id FROM employees").fetchall()
         for row in employee_ids:
             ensure_employee_access(conn, row["id"])
@@ -397,27 +1193,59 @@ def infer_columns(columns):
     return resolved
 
 
-def coerce_number(value):
-    if pd.isna(value):
-        return None
-    if isinstance(value, (int, float)):
-        return float(value)
-    match = re.search(r"-?\\d+[\\.,]?\\d*", str(value))
-    if not match:
-        return None
-    return float(match.group(0).replace(",", "."))
+NUMBER_PATTERN = r"(-?\d+[\.,]?\d*)"
+IMPORT_CHUNK_SIZE = int(os.environ.get("IMPORT_CHUNK_SIZE", "20000"))
+RECORD_COLUMNS = ["product", "stock", "sales_qty", "sales_amount", "record_date"]
+PRODUCT_PART_COLUMNS = ["brand", "characteristic"]
+RECORD_SORTS = {
+    "created_at": (
+        "records.created_at",
+        "desc",
+        "records JOIN products ON products.id = records.product_id",
+    ),
+    "product": (
+        "products.product_key",
+        "asc",
+        "products CROSS JOIN records ON records.product_id = products.id",
+    ),
+}
+RECORDS_PAGE_SIZE = int(os.environ.get("RECORDS_PAGE_SIZE", "100"))
+RECORDS_PAGE_MAX = int(os.environ.get("RECORDS_PAGE_MAX", "1000"))
+ANALYTICS_TOP_MAX = int(os.environ.get("ANALYTICS_TOP_MAX", "100"))
+ANALYTICS_DIMENSIONS = {
+    "period": "period",
+    "location": "location_id",
+    "product": "product_id",
+}
+
+
+def coerce_number_series(series):
+    numeric = pd.to_numeric(series, errors="coerce")
+    text_mask = numeric.isna() & series.notna()
+    if text_mask.any():
+        extracted = (
+            series[text_mask]
+            .astype(str)
+            .str.extract(NUMBER_PATTERN, expand=False)
+            .str.replace(",", ".", regex=False)
+        )
+        numeric = numeric.astype(float)
+        numeric[text_mask] = pd.to_numeric(extracted, errors="coerce")
+    return numeric.astype(float)
 
 
-def parse_excel(path):
-    if path.lower().endswith(".csv"):
-        data = pd.read_csv(path)
-    else:
-        data = pd.read_excel(path)
-    mapping = infer_columns(list(data.columns))
-    required = ["product", "stock"]
-    missing = [key for key in required if key not in mapping]
-    if missing:
-        return None, f"Не найдены колонки: {', '.join(missing)}"
+def join_product_parts(parsed):
+    combined = pd.Series("", index=parsed.index, dtype=object)
+    for key in ["brand", "product", "characteristic"]:
+        if key not in parsed.columns:
+            continue
+        column = parsed[key]
+        part = column.where(column.notna(), "").astype(str).str.strip()
+        combined = combined.where(part == "", combined + " " + part)
+    return combined.str.lstrip(" ")
+
+
+def normalize_frame(data, mapping):
     rename_map = {}
     for key in [
         "product",
@@ -431,32 +1259,677 @@ def parse_excel(path):
         if key in mapping:
             rename_map[mapping[key]] = key
     parsed = data.rename(columns=rename_map)
-    if "brand" in parsed.columns or "characteristic" in parsed.columns:
-        parsed["product"] = parsed.apply(
-            lambda row: " ".join(
-                str(value).strip()
-                for value in [
-                    row.get("brand"),
-                    row.get("product"),
-                    row.get("characteristic"),
-                ]
-                if pd.notna(value) and str(value).strip()
-            ),
-            axis=1,
+    for key in PRODUCT_PART_COLUMNS:
+        if key not in parsed.columns:
+            parsed[key] = None
+    parsed["name"] = parsed["product"]
+    if parsed["brand"].notna().any() or parsed["characteristic"].notna().any():
+        parsed["product"] = join_product_parts(parsed)
+    parsed["stock"] = coerce_number_series(parsed["stock"])
+    for key in ["sales_qty", "sales_amount"]:
+        if key in parsed.columns:
+            parsed[key] = coerce_number_series(parsed[key])
+        else:
+            parsed[key] = None
+    if "record_date" not in parsed.columns:
+        parsed["record_date"] = None
+    return parsed[RECORD_COLUMNS + ["name"] + PRODUCT_PART_COLUMNS]
+
+
+def validate_mapping(mapping):
+    required = ["product", "stock"]
+    missing = [key for key in required if key not in mapping]
+    if missing:
+        return f"Не найдены колонки: {', '.join(missing)}"
+    return None
+
+
+def parse_excel(path):
+    if path.lower().endswith(".csv"):
+        data = pd.read_csv(path)
+    else:
+        data = pd.read_excel(path)
+    mapping = infer_columns(list(data.columns))
+    error = validate_mapping(mapping)
+    if error:
+        return None, error
+    return normalize_frame(data, mapping), None
+
+
+def _sheet_header(values):
+    header = []
+    seen = {}
+    for idx, value in enumerate(values):
+        name = str(value).strip() if value is not None else f"Unnamed: {idx}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        header.append(name)
+    return header
+
+
+def _read_csv_chunks(path, chunk_size):
+    total = os.path.getsize(path) or 1
+    with open(path, "rb") as handle:
+        for chunk in pd.read_csv(handle, chunksize=chunk_size):
+            yield chunk, min(handle.tell() / total, 1.0)
+
+
+def _read_xlsx_chunks(path, chunk_size):
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        first = next(rows, None)
+        if first is None:
+            return
+        header = _sheet_header(first)
+        total = max((sheet.max_row or 0) - 1, 1)
+        buffer = []
+        processed = 0
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            row = tuple(row[: len(header)])
+            buffer.append(row + (None,) * (len(header) - len(row)))
+            if len(buffer) >= chunk_size:
+                processed += len(buffer)
+                yield pd.DataFrame(buffer, columns=header), min(processed / total, 1.0)
+                buffer = []
+        if buffer or not processed:
+            yield pd.DataFrame(buffer, columns=header), 1.0
+    finally:
+        workbook.close()
+
+
+def _read_frame_chunks(path, chunk_size):
+    data = pd.read_excel(path)
+    total = len(data) or 1
+    for start in range(0, max(len(data), 1), chunk_size):
+        chunk = data.iloc[start : start + chunk_size]
+        yield chunk, min((start + len(chunk)) / total, 1.0)
+
+
+def read_file_chunks(path, chunk_size=IMPORT_CHUNK_SIZE):
+    lowered = path.lower()
+    if lowered.endswith(".csv"):
+        return _read_csv_chunks(path, chunk_size)
+    if lowered.endswith((".xlsx", ".xlsm")):
+        return _read_xlsx_chunks(path, chunk_size)
+    return _read_frame_chunks(path, chunk_size)
+
+
+def parse_excel_chunks(path, chunk_size=IMPORT_CHUNK_SIZE):
+    chunks = read_file_chunks(path, chunk_size)
+    first = next(chunks, None)
+    if first is None:
+        return None, "Файл пуст"
+    mapping = infer_columns(list(first[0].columns))
+    error = validate_mapping(mapping)
+    if error:
+        chunks.close()
+        return None, error
+
+    def normalized():
+        data, fraction = first
+        yield normalize_frame(data, mapping), fraction
+        for data, fraction in chunks:
+            yield normalize_frame(data, mapping), fraction
+
+    return normalized(), None
+
+
+def _column_values(series, kind):
+    present = series.notna()
+    if kind == "int":
+        values = np.trunc(series.astype(float)).astype("Int64").astype(object)
+    elif kind == "float":
+        values = series.astype(float).astype(object)
+    else:
+        values = series.astype(object)
+        values[present] = values[present].map(str)
+    return values.where(present, None).tolist()
+
+
+def build_record_columns(data):
+    products = _column_values(data["product"].astype(str), "str")
+    parts = {
+        key: _column_values(data[key], "str") if key in data.columns else [None] * len(data)
+        for key in PRODUCT_PART_COLUMNS
+    }
+    return {
+        **parts,
+        "name": _column_values(data["name"], "str") if "name" in data.columns else products,
+        "product": products,
+        "stock": _column_values(data["stock"], "int"),
+        "sales_qty": _column_values(data["sales_qty"], "int"),
+        "sales_amount": _column_values(data["sales_amount"], "float"),
+        "record_date": _column_values(data["record_date"], "str"),
+    }
+
+
+def _sum_present(values):
+    return sum(value for value in values if value is not None)
+
+
+def create_import_batch(
+    conn, location_id, source_file, created_at, import_job_id=None, content_sha256=None
+):
+    return conn.execute(
+        """
+        INSERT INTO import_batches
+        (location_id, source_file, import_job_id, created_at, content_sha256)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (location_id, source_file, import_job_id, created_at, content_sha256),
+    ).lastrowid
+
+
+def insert_records(
+    conn, location_id, data, source_file, created_at=None, import_job_id=None, batch_id=None
+):
+    created_at = created_at or datetime.utcnow().isoformat()
+    if batch_id is None:
+        batch_id = create_import_batch(conn, location_id, source_file, created_at, import_job_id)
+    columns = build_record_columns(data)
+    count = len(data)
+    product_ids = resolve_product_ids(conn, columns, created_at)
+    sales_dates = parse_sales_dates(columns["record_date"], created_at)
+    cursor = conn.executemany(
+        """
+        INSERT INTO records
+        (location_id, product_id, stock, sales_qty, sales_amount, record_date, source_file,
+         created_at, import_job_id, batch_id, sales_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        zip(
+            [location_id] * count,
+            product_ids,
+            columns["stock"],
+            columns["sales_qty"],
+            columns["sales_amount"],
+            columns["record_date"],
+            [source_file] * count,
+            [created_at] * count,
+            [import_job_id] * count,
+            [batch_id] * count,
+            sales_dates,
+        ),
+    )
+    if count:
+        conn.execute(
+            "UPDATE import_batches SET row_count = row_count + ? WHERE id = ?",
+            (count, batch_id),
         )
-    parsed["stock"] = parsed["stock"].apply(coerce_number)
-    if "sales_qty" in parsed.columns:
-        parsed["sales_qty"] = parsed["sales_qty"].apply(coerce_number)
+        upsert_current_stock(conn, location_id, product_ids, columns["stock"], batch_id, created_at)
+        add_location_totals(
+            conn,
+            location_id,
+            _sum_present(columns["sales_qty"]),
+            _sum_present(columns["sales_amount"]),
+            count,
+            created_at,
+        )
+        add_sales_rollups(
+            conn, location_id, product_ids, sales_dates, columns["sales_qty"], columns["sales_amount"]
+        )
+    return cursor.rowcount
+
+
+def resolve_product_ids(conn, columns, created_at):
+    keys = [normalize_product_key(product) for product in columns["product"]]
+    products = {}
+    for key, display_name, name, brand, characteristic in zip(
+        keys, columns["product"], columns["name"], columns["brand"], columns["characteristic"]
+    ):
+        products.setdefault(key, (key, display_name, brand, name, characteristic, created_at))
+    conn.executemany(
+        """
+        INSERT INTO products (product_key, display_name, brand, name, characteristic, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(product_key) DO UPDATE SET
+            brand = COALESCE(products.brand, excluded.brand),
+            characteristic = COALESCE(products.characteristic, excluded.characteristic)
+        WHERE products.brand IS NULL AND products.characteristic IS NULL
+        """,
+        products.values(),
+    )
+    ids = dict(
+        conn.execute(
+            """
+            SELECT product_key, id FROM products
+            WHERE product_key IN (SELECT value FROM json_each(?))
+            """,
+            (json.dumps(list(products), ensure_ascii=False),),
+        ).fetchall()
+    )
+    return [ids[key] for key in keys]
+
+
+def upsert_current_stock(conn, location_id, product_ids, stocks, batch_id, updated_at):
+    conn.executemany(
+        """
+        INSERT INTO current_stock (location_id, product_id, stock, batch_id, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(location_id, product_id) DO UPDATE SET
+            stock = CASE
+                WHEN current_stock.batch_id = excluded.batch_id
+                THEN current_stock.stock + excluded.stock
+                ELSE excluded.stock
+            END,
+            batch_id = excluded.batch_id,
+            updated_at = excluded.updated_at
+        WHERE excluded.batch_id >= current_stock.batch_id
+        """,
+        [
+            (location_id, product_id, stock, batch_id, updated_at)
+            for product_id, stock in zip(product_ids, stocks)
+            if stock is not None
+        ],
+    )
+
+
+CURRENT_STOCK_SELECT = """
+    SELECT records.location_id, records.product_id, SUM(records.stock) AS stock,
+           records.batch_id, MAX(records.created_at) AS updated_at
+    FROM records
+    JOIN (
+        SELECT location_id, product_id, MAX(batch_id) AS batch_id
+        FROM records
+        WHERE stock IS NOT NULL {scope}
+        GROUP BY location_id, product_id
+    ) AS latest
+      ON latest.location_id = records.location_id
+     AND latest.product_id = records.product_id
+     AND latest.batch_id = records.batch_id
+    WHERE records.stock IS NOT NULL
+    GROUP BY records.location_id, records.product_id, records.batch_id
+"""
+
+
+def rebuild_current_stock(conn, location_id=None):
+    if location_id is None:
+        conn.execute("DELETE FROM current_stock")
+        select, params = CURRENT_STOCK_SELECT.format(scope=""), ()
     else:
-        parsed["sales_qty"] = None
-    if "sales_amount" in parsed.columns:
-        parsed["sales_amount"] = parsed["sales_amount"].apply(coerce_number)
+        conn.execute("DELETE FROM current_stock WHERE location_id = ?", (location_id,))
+        select, params = CURRENT_STOCK_SELECT.format(scope="AND location_id = ?"), (location_id,)
+    conn.execute(
+        f"""
+        INSERT INTO current_stock (location_id, product_id, stock, batch_id, updated_at)
+        {select}
+        """,
+        params,
+    )
+
+
+LOCATION_TOTALS_SELECT = """
+    SELECT location_id,
+           COALESCE(SUM(sales_qty), 0) AS total_sales_qty,
+           COALESCE(SUM(sales_amount), 0) AS total_sales_amount,
+           COUNT(*) AS record_count,
+           MAX(created_at) AS last_update
+    FROM records
+"""
+
+
+def refresh_location_stock(conn, location_id=None):
+    scope, params = ("WHERE location_id = ?", (location_id,)) if location_id else ("", ())
+    conn.execute(
+        f"""
+        UPDATE location_totals
+        SET total_stock = COALESCE(
+            (
+                SELECT SUM(stock) FROM current_stock
+                WHERE current_stock.location_id = location_totals.location_id
+            ),
+            0
+        )
+        {scope}
+        """,
+        params,
+    )
+
+
+def add_location_totals(conn, location_id, sales_qty, sales_amount, count, last_update):
+    conn.execute(
+        """
+        INSERT INTO location_totals
+        (location_id, total_sales_qty, total_sales_amount, record_count, last_update)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(location_id)
+        DO UPDATE SET total_sales_qty = total_sales_qty + excluded.total_sales_qty,
+                      total_sales_amount = total_sales_amount + excluded.total_sales_amount,
+                      record_count = record_count + excluded.record_count,
+                      last_update = MAX(COALESCE(last_update, ''), excluded.last_update)
+        """,
+        (location_id, sales_qty, sales_amount, count, last_update),
+    )
+    refresh_location_stock(conn, location_id)
+
+
+def delete_import_job_records(conn, job_id):
+    removed = conn.execute(
+        f"{LOCATION_TOTALS_SELECT} WHERE import_job_id = ? GROUP BY location_id",
+        (job_id,),
+    ).fetchall()
+    conn.execute("DELETE FROM records WHERE import_job_id = ?", (job_id,))
+    conn.execute("DELETE FROM import_batches WHERE import_job_id = ?", (job_id,))
+    for row in removed:
+        conn.execute(
+            """
+            UPDATE location_totals
+            SET total_sales_qty = total_sales_qty - ?,
+                total_sales_amount = total_sales_amount - ?,
+                record_count = record_count - ?,
+                last_update = (
+                    SELECT MAX(created_at) FROM records WHERE location_id = ?
+                )
+            WHERE location_id = ?
+            """,
+            (
+                row["total_sales_qty"],
+                row["total_sales_amount"],
+                row["record_count"],
+                row["location_id"],
+                row["location_id"],
+            ),
+        )
+        rebuild_current_stock(conn, row["location_id"])
+        refresh_location_stock(conn, row["location_id"])
+        rebuild_sales_rollups(conn, row["location_id"])
+
+
+def refresh_location_aggregates(conn, location_id):
+    conn.execute("DELETE FROM location_totals WHERE location_id = ?", (location_id,))
+    conn.execute(
+        f"""
+        INSERT INTO location_totals
+        (location_id, total_sales_qty, total_sales_amount, record_count, last_update)
+        {LOCATION_TOTALS_SELECT} WHERE location_id = ? GROUP BY location_id
+        """,
+        (location_id,),
+    )
+    rebuild_current_stock(conn, location_id)
+    refresh_location_stock(conn, location_id)
+    rebuild_sales_rollups(conn, location_id)
+
+
+def drop_known_rows(conn, location_id, data, batch_id, diff):
+    dated = data["record_date"].notna()
+    if not dated.any():
+        return data
+    columns = build_record_columns(data)
+    keys = [normalize_product_key(product) for product in columns["product"]]
+    existing = conn.execute(
+        """
+        SELECT records.id, products.product_key, records.record_date, records.stock,
+               records.sales_qty, records.sales_amount
+        FROM records
+        JOIN products ON products.id = records.product_id
+        WHERE records.location_id = ?
+          AND records.batch_id IS NOT ?
+          AND records.product_id IN (
+              SELECT id FROM products WHERE product_key IN (SELECT value FROM json_each(?))
+          )
+          AND records.record_date IN (SELECT value FROM json_each(?))
+        """,
+        (
+            location_id,
+            batch_id,
+            json.dumps(sorted(set(keys)), ensure_ascii=False),
+            json.dumps(sorted({value for value in columns["record_date"] if value is not None})),
+        ),
+    ).fetchall()
+    available = {}
+    for row in existing:
+        if row["id"] not in diff["matched"]:
+            signature = tuple(row)[1:]
+            available.setdefault(signature, []).append(row["id"])
+    keep = []
+    for key, record_date, stock, sales_qty, sales_amount in zip(
+        keys, columns["record_date"], columns["stock"], columns["sales_qty"], columns["sales_amount"]
+    ):
+        if record_date is None:
+            keep.append(True)
+            continue
+        diff["keys"].add((key, record_date))
+        matches = available.get((key, record_date, stock, sales_qty, sales_amount))
+        if matches:
+            diff["matched"].add(matches.pop())
+            keep.append(False)
+        else:
+            keep.append(True)
+    diff["skipped"] += keep.count(False)
+    return data[keep]
+
+
+def finalize_import_diff(conn, location_id, batch_id, diff):
+    if not diff["keys"]:
+        return 0
+    superseded = [
+        row
+        for row in conn.execute(
+            """
+            SELECT records.id, records.batch_id
+            FROM json_each(?) AS incoming
+            CROSS JOIN products ON products.product_key = json_extract(incoming.value, '$[0]')
+            CROSS JOIN records ON records.product_id = products.id
+             AND records.location_id = ?
+             AND records.record_date = json_extract(incoming.value, '$[1]')
+            WHERE records.batch_id IS NOT ?
+            """,
+            (json.dumps(sorted(diff["keys"]), ensure_ascii=False), location_id, batch_id),
+        ).fetchall()
+        if row["id"] not in diff["matched"]
+    ]
+    if not superseded:
+        return 0
+    conn.executemany("DELETE FROM records WHERE id = ?", [(row["id"],) for row in superseded])
+    batch_ids = sorted({row["batch_id"] for row in superseded if row["batch_id"] is not None})
+    conn.execute(
+        """
+        UPDATE import_batches
+        SET content_sha256 = NULL,
+            row_count = (SELECT COUNT(*) FROM records WHERE records.batch_id = import_batches.id)
+        WHERE id IN (SELECT value FROM json_each(?))
+        """,
+        (json.dumps(batch_ids),),
+    )
+    refresh_location_aggregates(conn, location_id)
+    return len(superseded)
+
+
+def rebuild_location_totals(conn):
+    conn.execute("DELETE FROM location_totals")
+    conn.execute(
+        f"""
+        INSERT INTO location_totals
+        (location_id, total_sales_qty, total_sales_amount, record_count, last_update)
+        {LOCATION_TOTALS_SELECT} GROUP BY location_id
+        """
+    )
+    refresh_location_stock(conn)
+
+
+SALES_GRAINS = {
+    "day": "sales_date",
+    "week": "date(sales_date, 'weekday 0', '-6 days')",
+    "month": "strftime('%Y-%m-01', sales_date)",
+}
+# Mirrors parse_sales_dates: only well-formed ISO or dd.mm.yyyy values that
+# survive a date() round-trip count, anything else falls back to the upload day.
+# The '+0 days' modifier makes SQLite normalize impossible days like 02-30
+# instead of passing them through.
+SALES_DATE_ISO_SQL = "substr(trim(record_date), 1, 10)"
+SALES_DATE_DMY_SQL = (
+    "substr(trim(record_date), 7, 4) || '-' || substr(trim(record_date), 4, 2)"
+    " || '-' || substr(trim(record_date), 1, 2)"
+)
+SALES_DATE_SQL = f"""
+    CASE
+        WHEN {SALES_DATE_ISO_SQL} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
+         AND date({SALES_DATE_ISO_SQL}, '+0 days') = {SALES_DATE_ISO_SQL}
+         AND {SALES_DATE_ISO_SQL} >= '0001'
+        THEN {SALES_DATE_ISO_SQL}
+        WHEN trim(record_date) GLOB '[0-9][0-9].[0-9][0-9].[0-9][0-9][0-9][0-9]*'
+         AND date({SALES_DATE_DMY_SQL}, '+0 days') = {SALES_DATE_DMY_SQL}
+         AND {SALES_DATE_DMY_SQL} >= '0001'
+        THEN {SALES_DATE_DMY_SQL}
+        ELSE substr(created_at, 1, 10)
+    END
+"""
+
+
+SALES_DATE_FORMATS = [
+    (r"\d{4}-\d{2}-\d{2}", "%Y-%m-%d"),
+    (r"\d{2}\.\d{2}\.\d{4}", "%d.%m.%Y"),
+]
+
+
+def parse_sales_dates(record_dates, created_at):
+    fallback = created_at[:10]
+    parsed = {}
+    for value in set(record_dates):
+        text = (value or "").strip()[:10]
+        day = None
+        for pattern, fmt in SALES_DATE_FORMATS:
+            if re.fullmatch(pattern, text):
+                try:
+                    day = datetime.strptime(text, fmt).date().isoformat()
+                except ValueError:
+                    pass
+                break
+        parsed[value] = day or fallback
+    return [parsed[value] for value in record_dates]
+
+
+def sales_periods(day):
+    value = date.fromisoformat(day)
+    return {
+        "day": day,
+        "week": (value - timedelta(days=value.weekday())).isoformat(),
+        "month": value.replace(day=1).isoformat(),
+    }
+
+
+def add_sales_rollups(conn, location_id, product_ids, sales_dates, sales_qty, sales_amount):
+    periods = {}
+    totals = {}
+    for product_id, day, qty, amount in zip(product_ids, sales_dates, sales_qty, sales_amount):
+        if qty is None and amount is None:
+            continue
+        if day not in periods:
+            periods[day] = sales_periods(day)
+        for grain, period in periods[day].items():
+            key = (grain, period, product_id)
+            current = totals.get(key, (0, 0.0))
+            totals[key] = (current[0] + (qty or 0), current[1] + (amount or 0))
+    conn.executemany(
+        """
+        INSERT INTO sales_rollups (grain, period, location_id, product_id, sales_qty, sales_amount)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(grain, period, location_id, product_id)
+        DO UPDATE SET sales_qty = sales_qty + excluded.sales_qty,
+                      sales_amount = sales_amount + excluded.sales_amount
+        """,
+        [
+            (grain, period, location_id, product_id, qty, amount)
+            for (grain, period, product_id), (qty, amount) in totals.items()
+        ],
+    )
+
+
+def rebuild_sales_rollups(conn, location_id=None):
+    if location_id is None:
+        conn.execute("DELETE FROM sales_rollups")
+        scope, params = "", ()
     else:
-        parsed["sales_amount"] = None
-    if "record_date" not in parsed.columns:
-        parsed["record_date"] = None
-    parsed = parsed[["product", "stock", "sales_qty", "sales_amount", "record_date"]]
-    return parsed, None
+        conn.execute("DELETE FROM sales_rollups WHERE location_id = ?", (location_id,))
+        scope, params = "AND location_id = ?", (location_id,)
+    for grain, period in SALES_GRAINS.items():
+        conn.execute(
+            f"""
+            INSERT INTO sales_rollups
+            (grain, period, location_id, product_id, sales_qty, sales_amount)
+            SELECT ?, {period}, location_id, product_id,
+                   COALESCE(SUM(sales_qty), 0), COALESCE(SUM(sales_amount), 0)
+            FROM records
+            WHERE (sales_qty IS NOT NULL OR sales_amount IS NOT NULL) {scope}
+            GROUP BY 2, location_id, product_id
+            """,
+            (grain, *params),
+        )
+
+
+def diff_location_totals(conn):
+    expected = {
+        row["location_id"]: {**dict(row), "total_stock": 0}
+        for row in conn.execute(f"{LOCATION_TOTALS_SELECT} GROUP BY location_id").fetchall()
+    }
+    for row in conn.execute(
+        f"""
+        SELECT location_id, SUM(stock) AS total_stock
+        FROM ({CURRENT_STOCK_SELECT.format(scope="")})
+        GROUP BY location_id
+        """
+    ).fetchall():
+        expected[row["location_id"]]["total_stock"] = row["total_stock"]
+    stored = {
+        row["location_id"]: dict(row)
+        for row in conn.execute("SELECT * FROM location_totals").fetchall()
+    }
+    empty = {
+        "total_stock": 0,
+        "total_sales_qty": 0,
+        "total_sales_amount": 0,
+        "record_count": 0,
+        "last_update": None,
+    }
+    diffs = []
+    for location_id in sorted(set(expected) | set(stored)):
+        want = expected.get(location_id, empty)
+        have = stored.get(location_id, empty)
+        for field in empty:
+            if field == "total_sales_amount":
+                matches = abs((want[field] or 0) - (have[field] or 0)) < 0.01
+            else:
+                matches = want[field] == have[field]
+            if not matches:
+                diffs.append(
+                    {
+                        "location_id": location_id,
+                        "field": field,
+                        "expected": want[field],
+                        "stored": have[field],
+                    }
+                )
+    return diffs
+
+
+@app.cli.command("check-location-totals")
+@click.option(
+    "--fix", is_flag=True, help="Rebuild current_stock and location_totals from records."
+)
+def check_location_totals_command(fix):
+    init_db()
+    with get_db() as conn:
+        diffs = diff_location_totals(conn)
+        for diff in diffs:
+            click.echo(
+                f"location {diff['location_id']}: {diff['field']} "
+                f"stored={diff['stored']} expected={diff['expected']}"
+            )
+        if not diffs:
+            click.echo("location_totals is consistent with records.")
+        elif fix:
+            rebuild_current_stock(conn)
+            rebuild_location_totals(conn)
+            click.echo("current_stock and location_totals rebuilt from records.")
+    if diffs and not fix:
+        raise SystemExit(1)
 
 
 def require_auth():
@@ -478,7 +1951,7 @@ def require_auth():
         return None
     if session.get("authed") and not is_auth_fresh():
         session.clear()
-    if request.path in open_paths:
+    if request.path in open_paths or request.path == "/api/cdek/webhook":
         return None
     if request.path in protected_pages and not session.get("authed"):
         return redirect("/login")
@@ -587,6 +2060,326 @@ CDEK_ORDERS_URL = os.environ.get("CDEK_ORDERS_URL", f"{CDEK_API_BASE}/orders")
 CDEK_CLIENT_ID = os.environ.get("CDEK_CLIENT_ID")
 CDEK_CLIENT_SECRET = os.environ.get("CDEK_CLIENT_SECRET")
 CDEK_UPDATE_INTERVAL = int(os.environ.get("CDEK_UPDATE_INTERVAL", "300"))
+CDEK_CONCURRENCY = int(os.environ.get("CDEK_CONCURRENCY", "8"))
+CDEK_HTTP_TIMEOUT = float(os.environ.get("CDEK_HTTP_TIMEOUT", "10"))
+CDEK_FETCH_ATTEMPTS = 3
+CDEK_CALL_TIMEOUT = float(os.environ.get("CDEK_CALL_TIMEOUT", "300"))
+# Request handlers wait for one fetch with its retries, not for a whole sweep.
+CDEK_REQUEST_TIMEOUT = float(
+    os.environ.get("CDEK_REQUEST_TIMEOUT", str(CDEK_HTTP_TIMEOUT * CDEK_FETCH_ATTEMPTS + 5))
+)
+CDEK_MAX_POLL_INTERVAL = int(os.environ.get("CDEK_MAX_POLL_INTERVAL", str(6 * 3600)))
+CDEK_BACKOFF_FACTOR = float(os.environ.get("CDEK_BACKOFF_FACTOR", "0.25"))
+CDEK_SCHEDULER_TICK = min(CDEK_UPDATE_INTERVAL, 60)
+CDEK_SWEEP_LIMIT = int(os.environ.get("CDEK_SWEEP_LIMIT", "500"))
+CDEK_RATE_LIMIT = float(os.environ.get("CDEK_RATE_LIMIT", "10"))
+CDEK_RATE_BURST = int(os.environ.get("CDEK_RATE_BURST", "20"))
+# The limiter lives in each process; with N web workers each one gets 1/N of the
+# budget so the total request rate stays within CDEK_RATE_LIMIT.
+CDEK_PROCESSES = max(
+    int(os.environ.get("CDEK_PROCESSES", os.environ.get("WEB_CONCURRENCY", "1"))), 1
+)
+CDEK_BREAKER_THRESHOLD = int(os.environ.get("CDEK_BREAKER_THRESHOLD", "5"))
+CDEK_BREAKER_RESET = int(os.environ.get("CDEK_BREAKER_RESET", "60"))
+CDEK_TOKEN_LEASE = int(os.environ.get("CDEK_TOKEN_LEASE", "30"))
+CDEK_WEBHOOKS_URL = os.environ.get("CDEK_WEBHOOKS_URL", f"{CDEK_API_BASE}/webhooks")
+CDEK_WEBHOOK_SECRET = os.environ.get("CDEK_WEBHOOK_SECRET")
+CDEK_RECONCILE_INTERVAL = int(os.environ.get("CDEK_RECONCILE_INTERVAL", str(6 * 3600)))
+CDEK_STATUS_NAMES = {
+    "CREATED": "Создан",
+    "ACCEPTED": "Принят",
+    "RECEIVED_AT_SHIPMENT_WAREHOUSE": "Принят на склад отправителя",
+    "READY_TO_SHIP_AT_SENDING_OFFICE": "Выдан на отправку в г. отправителе",
+    "TAKEN_BY_TRANSPORTER_FROM_SENDER_CITY": "Сдан перевозчику в г. отправителе",
+    "SENT_TO_TRANSIT_CITY": "Отправлен в г. транзит",
+    "ACCEPTED_IN_TRANSIT_CITY": "Встречен в г. транзите",
+    "SENT_TO_RECIPIENT_CITY": "Отправлен в г. получатель",
+    "ACCEPTED_IN_RECIPIENT_CITY": "Встречен в г. получателе",
+    "ACCEPTED_AT_RECIPIENT_CITY_WAREHOUSE": "Принят на склад доставки",
+    "ACCEPTED_AT_PICK_UP_POINT": "Принят на склад до востребования",
+    "TAKEN_BY_COURIER": "Выдан на доставку",
+    "DELIVERED": "Вручен",
+    "NOT_DELIVERED": "Не вручен",
+    "INVALID": "Некорректный заказ",
+}
+CDEK_STATUS_CODES_BY_NAME = {name: code for code, name in CDEK_STATUS_NAMES.items()}
+CDEK_TERMINAL_STATES = {
+    "DELIVERED",
+    "RETURNED",
+    "RETURNED_TO_SENDER",
+    "CANCELED",
+    "CANCELLED",
+    "INVALID",
+    "REMOVED",
+}
+# Not final: a return to the sender follows, so keep polling, just rarely.
+CDEK_SLOW_POLL_STATES = {"NOT_DELIVERED"}
+
+try:
+    import h2  # noqa: F401
+
+    CDEK_HTTP2 = True
+except ImportError:
+    CDEK_HTTP2 = False
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+cdek_loop = None
+cdek_loop_lock = threading.Lock()
+cdek_http_client = None
+
+
+def get_cdek_loop():
+    global cdek_loop
+    with cdek_loop_lock:
+        if cdek_loop is None:
+            cdek_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=cdek_loop.run_forever, name="cdek-loop", daemon=True
+            ).start()
+        return cdek_loop
+
+
+def run_cdek_coroutine(coro, timeout=CDEK_CALL_TIMEOUT):
+    future = asyncio.run_coroutine_threadsafe(coro, get_cdek_loop())
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise
+
+
+def get_cdek_http_client():
+    global cdek_http_client
+    if cdek_http_client is None:
+        cdek_http_client = httpx.AsyncClient(
+            timeout=CDEK_HTTP_TIMEOUT,
+            http2=CDEK_HTTP2,
+            limits=httpx.Limits(
+                max_connections=CDEK_CONCURRENCY,
+                max_keepalive_connections=CDEK_CONCURRENCY,
+            ),
+        )
+    return cdek_http_client
+
+
+class CdekUnavailableError(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.blocked_until = 0.0
+        self._updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def pause(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        waited = 0.0
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                delay = self.blocked_until - now
+            else:
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            waited += delay
+            await asyncio.sleep(delay)
+
+    def snapshot(self):
+        now = time.monotonic()
+        tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        return {
+            "rate": self.rate,
+            "capacity": self.capacity,
+            "tokens": round(tokens, 2),
+            "paused_for": round(max(self.blocked_until - now, 0), 2),
+        }
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+
+    # Returns (allowed, is_probe); only the caller holding the probe releases it.
+    def allow(self):
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False, False
+                self.state = "half_open"
+            if self.state == "half_open":
+                # Only one probe request goes out until it finishes.
+                if self.probe_in_flight:
+                    return False, False
+                self.probe_in_flight = True
+                return True, True
+            return True, False
+
+    def release_probe(self):
+        with self._lock:
+            self.probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    cdek_metrics["circuit_opened"] += 1
+                    logger.error("CDEK circuit breaker opened after %s failures.", self.failures)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "probe_in_flight": self.probe_in_flight,
+            "failures": self.failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout": self.reset_timeout,
+        }
+
+
+cdek_metrics = Counter()
+cdek_rate_limiter = TokenBucket(
+    CDEK_RATE_LIMIT / CDEK_PROCESSES, max(CDEK_RATE_BURST // CDEK_PROCESSES, 1)
+)
+cdek_circuit_breaker = CircuitBreaker(CDEK_BREAKER_THRESHOLD, CDEK_BREAKER_RESET)
+
+
+def _parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(retry_at.tzinfo)).total_seconds(), 0)
+
+
+async def cdek_request(method, url, **kwargs):
+    allowed, probe = cdek_circuit_breaker.allow()
+    if not allowed:
+        cdek_metrics["circuit_rejected"] += 1
+        raise CdekUnavailableError("CDEK circuit breaker is open.")
+    try:
+        waited = await cdek_rate_limiter.acquire()
+        if waited:
+            cdek_metrics["throttled"] += 1
+            cdek_metrics["throttled_seconds"] += waited
+        cdek_metrics["requests"] += 1
+        try:
+            response = await get_cdek_http_client().request(method, url, **kwargs)
+        except httpx.RequestError:
+            cdek_metrics["network_errors"] += 1
+            cdek_circuit_breaker.record_failure()
+            raise
+        if response.status_code == 429:
+            cdek_metrics["rate_limited"] += 1
+            retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            cdek_rate_limiter.pause(retry_after if retry_after is not None else 1)
+        elif response.status_code >= 500:
+            cdek_metrics["server_errors"] += 1
+            cdek_circuit_breaker.record_failure()
+        else:
+            cdek_circuit_breaker.record_success()
+        return response
+    finally:
+        # Requests already in flight when the breaker went half-open must not
+        # clear the flag; the probe releases it whatever its outcome.
+        if probe:
+            cdek_circuit_breaker.release_probe()
+
+
+def get_cdek_metrics():
+    metrics = dict(cdek_metrics)
+    metrics["throttled_seconds"] = round(metrics.get("throttled_seconds", 0), 3)
+    return {
+        "counters": metrics,
+        "rate_limiter": cdek_rate_limiter.snapshot(),
+        "circuit_breaker": cdek_circuit_breaker.snapshot(),
+    }
+
+
+def _load_cdek_token():
+    with get_db() as conn:
+        return conn.execute("SELECT * FROM cdek_tokens WHERE id = 1").fetchone()
+
+
+def _claim_cdek_token_refresh(owner):
+    now = datetime.utcnow()
+    lease_until = now + timedelta(seconds=CDEK_TOKEN_LEASE)
+    with get_db() as conn:
+        conn.execute("INSERT OR IGNORE INTO cdek_tokens (id) VALUES (1)")
+        result = conn.execute(
+            """
+            UPDATE cdek_tokens
+            SET refresh_owner = ?, refresh_lease_until = ?
+            WHERE id = 1 AND (refresh_lease_until IS NULL OR refresh_lease_until < ?)
+            """,
+            (owner, lease_until.isoformat(), now.isoformat()),
+        )
+    return result.rowcount == 1
+
+
+def _store_cdek_token(owner, token, expires_at):
+    with get_db() as conn:
+        conn.execute(
+            """
+            UPDATE cdek_tokens
+            SET client_id = ?, access_token = COALESCE(?, access_token),
+                expires_at = COALESCE(?, expires_at), updated_at = ?,
+                refresh_owner = NULL, refresh_lease_until = NULL
+            WHERE id = 1 AND refresh_owner = ?
+            """,
+            (
+                CDEK_CLIENT_ID,
+                token,
+                expires_at.isoformat() if expires_at else None,
+                datetime.utcnow().isoformat(),
+                owner,
+            ),
+        )
+
+
+def _invalidate_cdek_token(token):
+    with get_db() as conn:
+        conn.execute(
+            "UPDATE cdek_tokens SET access_token = NULL, expires_at = NULL "
+            "WHERE id = 1 AND access_token = ?",
+            (token,),
+        )
 
 
 class CdekAuthManager:
@@ -594,9 +2387,22 @@ class CdekAuthManager:
         self._token = None
         self._expires_at = datetime.utcnow()
         self._lock = asyncio.Lock()
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def _cached(self, row):
+        if not row or not row["access_token"] or row["client_id"] != CDEK_CLIENT_ID:
+            return None
+        expires_at = _parse_iso_timestamp(row["expires_at"])
+        if not expires_at or datetime.utcnow() >= expires_at:
+            return None
+        self._token = row["access_token"]
+        self._expires_at = expires_at
+        return self._token
 
     async def reset_token(self):
         async with self._lock:
+            if self._token:
+                await asyncio.to_thread(_invalidate_cdek_token, self._token)
             self._token = None
             self._expires_at = datetime.utcnow()
 
@@ -604,41 +2410,65 @@ class CdekAuthManager:
         if not CDEK_CLIENT_ID or not CDEK_CLIENT_SECRET:
             logger.warning("CDEK credentials are not configured.")
             return None
+        if self._token and datetime.utcnow() < self._expires_at:
+            return self._token
         async with self._lock:
             if self._token and datetime.utcnow() < self._expires_at:
                 return self._token
-            async with httpx.AsyncClient(timeout=20) as client:
-                try:
-                    response = await client.post(
-                        CDEK_TOKEN_URL,
-                        data={
-                            "grant_type": "client_credentials",
-                            "client_id": CDEK_CLIENT_ID,
-                            "client_secret": CDEK_CLIENT_SECRET,
-                        },
-                    )
-                    response.raise_for_status()
-                except httpx.HTTPStatusError as exc:
-                    logger.error(
-                        "CDEK OAuth token request failed with HTTP %s.",
-                        exc.response.status_code,
-                    )
-                    logger.error("CDEK OAuth token response: %s", exc.response.text)
-                    return None
-                except httpx.RequestError:
-                    logger.exception("Failed to fetch CDEK OAuth token.")
+            deadline = time.monotonic() + CDEK_TOKEN_LEASE
+            while True:
+                token = self._cached(await asyncio.to_thread(_load_cdek_token))
+                if token:
+                    return token
+                if await asyncio.to_thread(_claim_cdek_token_refresh, self._owner):
+                    break
+                if time.monotonic() >= deadline:
+                    logger.warning("Timed out waiting for another worker's CDEK token.")
                     return None
-            data = response.json()
-            token = data.get("access_token")
-            if not token:
-                logger.error("CDEK OAuth token response missing access_token.")
-                return None
-            expires_in = data.get("expires_in") or 0
-            expires_in = max(int(expires_in) - 60, 60) if expires_in else 300
-            self._token = token
-            self._expires_at = datetime.utcnow() + timedelta(seconds=int(expires_in))
+                await asyncio.sleep(0.2)
+            token, expires_at = await self._request_token()
+            await asyncio.to_thread(_store_cdek_token, self._owner, token, expires_at)
+            if token:
+                self._token = token
+                self._expires_at = expires_at
             return token
 
+    async def _request_token(self):
+        cdek_metrics["token_requests"] += 1
+        try:
+            response = await cdek_request(
+                "POST",
+                CDEK_TOKEN_URL,
+                data={
+                    "grant_type": "client_credentials",
+                    "client_id": CDEK_CLIENT_ID,
+                    "client_secret": CDEK_CLIENT_SECRET,
+                },
+                timeout=20,
+            )
+            response.raise_for_status()
+        except httpx.HTTPStatusError as exc:
+            logger.error(
+                "CDEK OAuth token request failed with HTTP %s.",
+                exc.response.status_code,
+            )
+            logger.error("CDEK OAuth token response: %s", exc.response.text)
+            return None, None
+        except httpx.RequestError:
+            logger.exception("Failed to fetch CDEK OAuth token.")
+            return None, None
+        except CdekUnavailableError:
+            logger.warning("Skipping CDEK OAuth token request: circuit is open.")
+            return None, None
+        data = response.json()
+        token = data.get("access_token")
+        if not token:
+            logger.error("CDEK OAuth token response missing access_token.")
+            return None, None
+        expires_in = data.get("expires_in") or 0
+        expires_in = max(int(expires_in) - 60, 60) if expires_in else 300
+        return token, datetime.utcnow() + timedelta(seconds=int(expires_in))
+
 
 cdek_auth_manager = CdekAuthManager()
 
@@ -660,31 +2490,38 @@ def _extract_cdek_status_location(status_item):
     return None
 
 
+def _normalize_cdek_status_item(item):
+    return {
+        "code": item.get("code")
+        or item.get("status_code")
+        or item.get("state_code"),
+        "status": item.get("name")
+        or item.get("status")
+        or item.get("description"),
+        "location": _extract_cdek_status_location(item),
+        "timestamp": item.get("date_time")
+        or item.get("timestamp")
+        or item.get("date"),
+    }
+
+
 def _extract_cdek_latest_status(statuses):
     if not statuses:
         return None
 
     def sort_key(item):
-        parsed = _parse_iso_timestamp(
-            item.get("date_time") or item.get("timestamp") or item.get("date")
-        )
+        parsed = _parse_iso_timestamp(item["timestamp"])
         if parsed:
-            return parsed
-        return item.get("date_time") or item.get("timestamp") or item.get("date") or ""
+            return parsed.timestamp()
+        return 0
 
-    latest = max(statuses, key=sort_key)
-    return {
-        "code": latest.get("code")
-        or latest.get("status_code")
-        or latest.get("state_code"),
-        "status": latest.get("name")
-        or latest.get("status")
-        or latest.get("description"),
-        "location": _extract_cdek_status_location(latest),
-        "timestamp": latest.get("date_time")
-        or latest.get("timestamp")
-        or latest.get("date"),
-    }
+    history = sorted(
+        (_normalize_cdek_status_item(item) for item in statuses if isinstance(item, dict)),
+        key=sort_key,
+    )
+    if not history:
+        return None
+    return {**history[-1], "history": history}
 
 
 def _extract_cdek_statuses(order_payload):
@@ -728,13 +2565,12 @@ def _sanitize_cdek_number(track_number: str):
 
 async def _fetch_cdek_order_payload(token: str, cdek_number: str):
     headers = {"Authorization": f"Bearer {token}"}
-    async with httpx.AsyncClient(timeout=30) as client:
-        response = await client.get(
-            CDEK_ORDERS_URL,
-            params={"cdek_number": cdek_number},
-            headers=headers,
-        )
-    return response
+    return await cdek_request(
+        "GET",
+        CDEK_ORDERS_URL,
+        params={"cdek_number": cdek_number},
+        headers=headers,
+    )
 
 
 async def _fetch_cdek_status_async(track_number: str):
@@ -744,7 +2580,7 @@ async def _fetch_cdek_status_async(track_number: str):
         return None
     logger.info("Fetching CDEK order status for %s.", sanitized)
     last_error = None
-    for attempt in range(3):
+    for attempt in range(CDEK_FETCH_ATTEMPTS):
         token = await cdek_auth_manager.get_token()
         if not token:
             return None
@@ -755,8 +2591,7 @@ async def _fetch_cdek_status_async(track_number: str):
                 await cdek_auth_manager.reset_token()
                 continue
             if response.status_code == 429:
-                logger.warning("CDEK rate limit reached. Sleeping before retry.")
-                await asyncio.sleep(0.5 * (attempt + 1))
+                logger.warning("CDEK rate limit reached. Waiting for the rate limiter.")
                 continue
             if response.status_code in {400, 404}:
                 logger.warning("CDEK orders API returned HTTP %s.", response.status_code)
@@ -770,6 +2605,9 @@ async def _fetch_cdek_status_async(track_number: str):
             response.raise_for_status()
             payload = response.json()
             return _parse_cdek_order_payload(payload)
+        except CdekUnavailableError:
+            logger.warning("Skipping CDEK status fetch for %s: circuit is open.", sanitized)
+            return None
         except httpx.RequestError as exc:
             last_error = exc
             logger.exception("Failed to fetch CDEK order status.")
@@ -783,12 +2621,27 @@ async def _fetch_cdek_status_async(track_number: str):
     return None
 
 
-def fetch_cdek_status(track_number: str):
+async def _fetch_cdek_statuses_async(track_numbers):
+    semaphore = asyncio.Semaphore(CDEK_CONCURRENCY)
+
+    async def fetch(track_number):
+        async with semaphore:
+            try:
+                return await _fetch_cdek_status_async(track_number)
+            except Exception:
+                logger.exception("Failed to fetch CDEK status for %s.", track_number)
+                return None
+
+    return await asyncio.gather(*(fetch(number) for number in track_numbers))
+
+
+def fetch_cdek_statuses(track_numbers, timeout=CDEK_REQUEST_TIMEOUT):
+    track_numbers = list(track_numbers)
     try:
-        return asyncio.run(_fetch_cdek_status_async(track_number))
-    except RuntimeError:
-        logger.exception("Failed to run CDEK async status fetch.")
-        return None
+        return run_cdek_coroutine(_fetch_cdek_statuses_async(track_numbers), timeout)
+    except Exception:
+        logger.exception("Failed to fetch CDEK statuses for %s shipments.", len(track_numbers))
+        return [None] * len(track_numbers)
 
 
 def _parse_iso_timestamp(value):
@@ -807,62 +2660,202 @@ def _parse_iso_timestamp(value):
     return None
 
 
-def _should_update_cdek_status(shipment_row, now):
-    last_update = _parse_iso_timestamp(shipment_row["last_update"])
-    if not last_update:
-        return True
-    if last_update.tzinfo is not None:
-        last_update = last_update.astimezone(timezone.utc).replace(tzinfo=None)
-    return now - last_update >= timedelta(seconds=CDEK_UPDATE_INTERVAL)
+def schedule_next_cdek_poll(status_code, status_changed_at, now):
+    status_code = (status_code or "").upper()
+    if status_code in CDEK_TERMINAL_STATES:
+        return None
+    base_interval = CDEK_RECONCILE_INTERVAL if CDEK_WEBHOOK_SECRET else CDEK_UPDATE_INTERVAL
+    if status_code in CDEK_SLOW_POLL_STATES:
+        interval = max(CDEK_MAX_POLL_INTERVAL, base_interval)
+        return (now + timedelta(seconds=interval)).isoformat()
+    changed_at = _parse_iso_timestamp(status_changed_at) or now
+    unchanged = max((now - changed_at).total_seconds(), 0)
+    interval = min(
+        max(base_interval, unchanged * CDEK_BACKOFF_FACTOR),
+        max(CDEK_MAX_POLL_INTERVAL, base_interval),
+    )
+    return (now + timedelta(seconds=interval)).isoformat()
+
+
+def record_cdek_status_history(conn, shipment_id, items):
+    events = []
+    for item in items:
+        code = item.get("code") or item.get("status_code") or item.get("status")
+        if not code:
+            continue
+        events.append((code, item.get("status"), item.get("location"), item.get("timestamp") or ""))
+    if not events:
+        return 0
+    conn.executemany(
+        "INSERT OR IGNORE INTO cdek_status_codes (code, name) VALUES (?, ?)",
+        [(code, name) for code, name, _, _ in events],
+    )
+    conn.executemany(
+        "UPDATE cdek_status_codes SET name = ? WHERE code = ? AND name IS NULL",
+        [(name, code) for code, name, _, _ in events if name],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO cdek_locations (name) VALUES (?)",
+        [(location,) for _, _, location, _ in events if location],
+    )
+    before = conn.total_changes
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO shipment_status_events
+        (shipment_id, timestamp, status_id, location_id)
+        VALUES (
+            ?, ?,
+            (SELECT id FROM cdek_status_codes WHERE code = ?),
+            (SELECT id FROM cdek_locations WHERE name = ?)
+        )
+        """,
+        [(shipment_id, timestamp, code, location) for code, _, location, timestamp in events],
+    )
+    return conn.total_changes - before
 
 
-def update_shipment_from_cdek(conn, shipment_row):
-    track_number = shipment_row["cdek_number"]
-    if not track_number:
-        return
-    status_data = fetch_cdek_status(track_number)
-    if not status_data:
-        return
-    current_code = shipment_row["cdek_state"]
-    current_status = shipment_row["last_status"]
-    current_location = shipment_row["last_location"]
-    current_timestamp = shipment_row["last_update"]
-    if (
-        status_data.get("code") == current_code
-        and status_data.get("status") == current_status
-        and status_data.get("location") == current_location
-        and status_data.get("timestamp") == current_timestamp
-    ):
-        return
-    with conn:
-        conn.execute(
-            """
-            UPDATE shipments
-            SET cdek_state = ?, last_status = ?, last_location = ?, last_update = ?
-            WHERE id = ?
-            """,
-            (
-                status_data.get("code"),
-                status_data.get("status"),
-                status_data.get("location"),
-                status_data.get("timestamp"),
-                shipment_row["id"],
-            ),
+def apply_cdek_status(conn, shipment_row, status_data, now=None):
+    now = now or datetime.utcnow()
+    if status_data:
+        record_cdek_status_history(
+            conn, shipment_row["id"], status_data.get("history") or [status_data]
         )
+    changed = bool(status_data) and not (
+        status_data.get("code") == shipment_row["cdek_state"]
+        and status_data.get("status") == shipment_row["last_status"]
+        and status_data.get("location") == shipment_row["last_location"]
+        and status_data.get("timestamp") == shipment_row["last_update"]
+    )
+    if not changed:
         conn.execute(
-            """
-            INSERT INTO shipment_status_history
-            (shipment_id, status, location, status_code, timestamp)
-            VALUES (?, ?, ?, ?, ?)
-            """,
+            "UPDATE shipments SET next_poll_at = ? WHERE id = ?",
             (
+                schedule_next_cdek_poll(
+                    shipment_row["cdek_state"], shipment_row["status_changed_at"], now
+                ),
                 shipment_row["id"],
-                status_data.get("status"),
-                status_data.get("location"),
-                status_data.get("code"),
-                status_data.get("timestamp"),
             ),
         )
+        return False
+    conn.execute(
+        """
+        UPDATE shipments
+        SET cdek_state = ?, last_status = ?, last_location = ?, last_update = ?,
+            status_changed_at = ?, next_poll_at = ?
+        WHERE id = ?
+        """,
+        (
+            status_data.get("code"),
+            status_data.get("status"),
+            status_data.get("location"),
+            status_data.get("timestamp"),
+            now.isoformat(),
+            schedule_next_cdek_poll(status_data.get("code"), None, now),
+            shipment_row["id"],
+        ),
+    )
+    shipment = conn.execute(
+        f"SELECT {SHIPMENT_FIELDS} FROM shipments WHERE id = ?",
+        (shipment_row["id"],),
+    ).fetchone()
+    publish_change(conn, "shipments", "updated", shipment["id"], dict(shipment))
+    return True
+
+
+def refresh_cdek_shipments(shipments, timeout=CDEK_REQUEST_TIMEOUT):
+    shipments = [row for row in shipments if row["cdek_number"]]
+    if not shipments:
+        return 0
+    statuses = fetch_cdek_statuses((row["cdek_number"] for row in shipments), timeout)
+    updated = 0
+    now = datetime.utcnow()
+    with get_db() as conn:
+        for row, status_data in zip(shipments, statuses):
+            updated += apply_cdek_status(conn, row, status_data, now)
+    return updated
+
+
+def parse_cdek_webhook(payload):
+    if not isinstance(payload, dict) or payload.get("type") != "ORDER_STATUS":
+        return None
+    attributes = payload.get("attributes")
+    if not isinstance(attributes, dict):
+        return None
+    cdek_number = _sanitize_cdek_number(str(attributes.get("cdek_number") or ""))
+    code = attributes.get("code")
+    if not cdek_number or not code:
+        return None
+    timestamp = attributes.get("status_date_time") or payload.get("date_time")
+    return {
+        "cdek_number": cdek_number,
+        "uuid": payload.get("uuid"),
+        "code": code,
+        "status": attributes.get("name") or CDEK_STATUS_NAMES.get(code, code),
+        "location": attributes.get("city_name") or _extract_cdek_status_location(attributes),
+        "timestamp": timestamp,
+    }
+
+
+def _as_utc(value):
+    if value is None or value.tzinfo is not None:
+        return value
+    return value.replace(tzinfo=timezone.utc)
+
+
+def _is_older_cdek_status(status_data, shipment_row):
+    incoming = _as_utc(_parse_iso_timestamp(status_data.get("timestamp")))
+    current = _as_utc(_parse_iso_timestamp(shipment_row["last_update"]))
+    if not incoming or not current:
+        return False
+    return incoming < current
+
+
+def ingest_cdek_webhook(conn, event):
+    event_key = sha256(
+        "|".join(
+            str(event.get(key) or "") for key in ["uuid", "cdek_number", "code", "timestamp"]
+        ).encode("utf-8")
+    ).hexdigest()
+    inserted = conn.execute(
+        """
+        INSERT OR IGNORE INTO cdek_webhook_events
+        (event_key, cdek_number, status_code, status_timestamp, received_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (
+            event_key,
+            event["cdek_number"],
+            event["code"],
+            event["timestamp"],
+            datetime.utcnow().isoformat(),
+        ),
+    ).rowcount
+    if not inserted:
+        return {"duplicate": True, "updated": 0}
+    shipments = conn.execute(
+        "SELECT * FROM shipments WHERE cdek_number = ?",
+        (event["cdek_number"],),
+    ).fetchall()
+    updated = 0
+    for shipment in shipments:
+        if _is_older_cdek_status(event, shipment):
+            # Late deliveries still belong in the history, just not in the state.
+            record_cdek_status_history(conn, shipment["id"], [event])
+            continue
+        updated += apply_cdek_status(conn, shipment, event)
+    return {"duplicate": False, "updated": updated}
+
+
+def get_due_shipments(conn, now, limit=None):
+    return conn.execute(
+        """
+        SELECT * FROM shipments
+        WHERE next_poll_at IS NOT NULL AND next_poll_at <= ?
+        ORDER BY next_poll_at
+        LIMIT ?
+        """,
+        (now.isoformat(), limit or CDEK_SWEEP_LIMIT),
+    ).fetchall()
 
 
 def get_actor_snapshot():
@@ -1199,14 +3192,11 @@ def list_employees():
             rows = conn.execute(
                 "SELECT id, name FROM employees ORDER BY created_at DESC"
             ).fetchall()
-        else:
-            rows = conn.execute(
-                "SELECT id, login, name, created_at FROM employees ORDER BY created_at DESC"
-            ).fetchall()
-    if public_view:
-        return jsonify([dict(row) for row in rows])
-    employees = []
-    with get_db() as conn:
+            return jsonify([dict(row) for row in rows])
+        rows = conn.execute(
+            "SELECT id, login, name, created_at FROM employees ORDER BY created_at DESC"
+        ).fetchall()
+        employees = []
         for row in rows:
             employee = dict(row)
             employee["access"] = get_employee_access_for_conn(conn, row["id"])
@@ -1423,6 +3413,12 @@ def list_course_progress(conn, login):
 @app.get("/api/training/overview")
 def training_overview():
     guard = require_page_access("training", redirect_on_fail=False)
+    if guard:
+        return guard
+    guard = require_not_modified(
+        ["profiles", "courses", "course_access", "course_progress", "course_badges"],
+        scope=f"{get_profile_login()}|{get_role()}|{get_profile_name()}",
+    )
     if guard:
         return guard
     login = get_profile_login()
@@ -1758,17 +3754,275 @@ def training_admin_data():
     return jsonify({"employees": employees_data, "courses": courses_data})
 
 
+def get_table_revisions(conn, tables):
+    placeholders = ", ".join("?" for _ in tables)
+    return conn.execute(
+        f"""
+        SELECT table_name, revision, updated_at FROM table_revisions
+        WHERE table_name IN ({placeholders})
+        ORDER BY table_name
+        """,
+        list(tables),
+    ).fetchall()
+
+
+def require_not_modified(tables, scope=""):
+    with get_db() as conn:
+        revisions = get_table_revisions(conn, tables)
+    key = [request.full_path, scope] + [
+        f"{row['table_name']}:{row['revision']}" for row in revisions
+    ]
+    etag = sha256("|".join(key).encode("utf-8")).hexdigest()[:32]
+    last_modified = max(
+        (_parse_iso_timestamp(row["updated_at"]) for row in revisions), default=None
+    )
+    if last_modified:
+        last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+    g.revision_tag = (etag, last_modified)
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        fresh = bool(
+            last_modified
+            and request.if_modified_since
+            and last_modified <= request.if_modified_since
+        )
+    if not fresh:
+        return None
+    return apply_revision_headers(Response(status=304))
+
+
+def apply_revision_headers(response):
+    revision_tag = g.pop("revision_tag", None)
+    if not revision_tag or response.status_code not in {200, 304}:
+        return response
+    etag, last_modified = revision_tag
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("Cookie")
+    return response
+
+
+app.after_request(apply_revision_headers)
+
+
+EVENTS_POLL_INTERVAL = float(os.environ.get("EVENTS_POLL_INTERVAL", "0.5"))
+EVENTS_KEEPALIVE = int(os.environ.get("EVENTS_KEEPALIVE", "15"))
+EVENTS_BUFFER_SIZE = int(os.environ.get("EVENTS_BUFFER_SIZE", "1000"))
+EVENTS_RETENTION = int(os.environ.get("EVENTS_RETENTION", str(24 * 3600)))
+EVENT_CHANNEL_PAGES = {
+    "tasks": "tasks",
+    "knowledge": "knowledge",
+    "shipments": "locations",
+    "locations": "locations",
+}
+TASK_FIELDS = """
+    id, title, status, priority, assignee, deadline,
+    created_by_name, created_by_login, created_by_role,
+    created_at, updated_at
+"""
+KNOWLEDGE_FIELDS = """
+    id, title, section, owner, tag,
+    created_by_name, created_by_login, created_by_role,
+    created_at, updated_at
+"""
+
+
+def parse_sync_cursor():
+    value = request.args.get("since", "")
+    return int(value) if value.isdigit() else None
+
+
+def load_sync_delta(conn, table, fields, since):
+    cursor = conn.execute(
+        "SELECT COALESCE(MAX(seq), 0) FROM sync_log WHERE table_name = ?",
+        (table,),
+    ).fetchone()[0]
+    rows = conn.execute(
+        f"""
+        SELECT sync_log.row_id, sync_log.deleted, {fields}
+        FROM sync_log
+        LEFT JOIN {table} ON {table}.id = sync_log.row_id
+        WHERE sync_log.table_name = ? AND sync_log.seq > ? AND sync_log.seq <= ?
+        ORDER BY sync_log.seq
+        """,
+        (table, since, cursor),
+    ).fetchall()
+    items = []
+    deleted = []
+    for row in rows:
+        if row["deleted"]:
+            deleted.append(row["row_id"])
+        elif row["id"] is not None:
+            items.append({key: row[key] for key in row.keys() if key not in {"row_id", "deleted"}})
+    return {"items": items, "deleted": deleted, "cursor": cursor}
+
+
+def publish_change(conn, channel, action, entity_id, data=None):
+    conn.execute(
+        """
+        INSERT INTO change_events (channel, action, entity_id, payload, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (
+            channel,
+            action,
+            entity_id,
+            json.dumps(data, ensure_ascii=False) if data is not None else None,
+            datetime.utcnow().isoformat(),
+        ),
+    )
+
+
+class ChangeFeed:
+    def __init__(self, poll_interval=EVENTS_POLL_INTERVAL, buffer_size=EVENTS_BUFFER_SIZE):
+        self.poll_interval = poll_interval
+        self.events = deque(maxlen=buffer_size)
+        self.condition = threading.Condition()
+        self.last_id = 0
+        self.floor_id = 0
+        self.thread = None
+
+    def start(self):
+        with self.condition:
+            if self.thread:
+                return
+            with get_db() as conn:
+                self.last_id = conn.execute(
+                    "SELECT COALESCE(MAX(id), 0) FROM change_events"
+                ).fetchone()[0]
+            self.floor_id = self.last_id
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        pruned_at = 0
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                with get_db() as conn:
+                    rows = conn.execute(
+                        "SELECT * FROM change_events WHERE id > ? ORDER BY id",
+                        (self.last_id,),
+                    ).fetchall()
+                    if time.monotonic() - pruned_at > 60:
+                        cutoff = datetime.utcnow() - timedelta(seconds=EVENTS_RETENTION)
+                        conn.execute(
+                            "DELETE FROM change_events WHERE created_at < ?",
+                            (cutoff.isoformat(),),
+                        )
+                        pruned_at = time.monotonic()
+            except sqlite3.Error:
+                logger.exception("Failed to read change events.")
+                continue
+            if not rows:
+                continue
+            with self.condition:
+                for row in rows:
+                    if len(self.events) == self.events.maxlen:
+                        self.floor_id = self.events[0]["id"]
+                    self.events.append(dict(row))
+                self.last_id = rows[-1]["id"]
+                self.condition.notify_all()
+
+    def _load_since(self, cursor):
+        with get_db() as conn:
+            oldest = conn.execute("SELECT MIN(id) FROM change_events").fetchone()[0]
+            if oldest is None or oldest > cursor + 1:
+                return None
+            return [
+                dict(row)
+                for row in conn.execute(
+                    "SELECT * FROM change_events WHERE id > ? AND id <= ? ORDER BY id",
+                    (cursor, self.last_id),
+                ).fetchall()
+            ]
+
+    def wait(self, cursor, timeout):
+        """Return events after cursor, or None when the client has to reload everything."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.last_id > cursor, timeout)
+            if cursor >= self.floor_id:
+                return [event for event in self.events if event["id"] > cursor]
+        return self._load_since(cursor)
+
+
+change_feed = ChangeFeed()
+
+
+def format_sse(event_id, event, data):
+    lines = [f"id: {event_id}", f"event: {event}"]
+    lines.extend(f"data: {line}" for line in json.dumps(data, ensure_ascii=False).split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+@app.get("/api/events")
+def stream_events():
+    requested = (request.args.get("channels") or ",".join(EVENT_CHANNEL_PAGES)).split(",")
+    channels = {
+        channel
+        for channel in requested
+        if channel in EVENT_CHANNEL_PAGES
+        and not require_page_access(EVENT_CHANNEL_PAGES[channel], redirect_on_fail=False)
+    }
+    if not channels:
+        return jsonify({"error": "forbidden"}), 403
+    change_feed.start()
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    cursor = int(last_event_id) if last_event_id.isdigit() else change_feed.last_id
+
+    def generate(cursor):
+        yield f"retry: 3000\nid: {cursor}\n\n"
+        while True:
+            events = change_feed.wait(cursor, EVENTS_KEEPALIVE)
+            if events is None:
+                cursor = change_feed.last_id
+                yield format_sse(cursor, "reset", {})
+                continue
+            if not events:
+                yield ": ping\n\n"
+                continue
+            for event in events:
+                cursor = event["id"]
+                if event["channel"] not in channels:
+                    continue
+                yield format_sse(
+                    cursor,
+                    event["channel"],
+                    {
+                        "action": event["action"],
+                        "id": event["entity_id"],
+                        "data": json.loads(event["payload"]) if event["payload"] else None,
+                    },
+                )
+
+    return Response(
+        stream_with_context(generate(cursor)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/api/tasks")
 def list_tasks():
     guard = require_page_access("tasks", redirect_on_fail=False)
     if guard:
         return guard
+    guard = require_not_modified(["tasks"])
+    if guard:
+        return guard
+    if "since" in request.args:
+        since = parse_sync_cursor()
+        if since is None:
+            return jsonify({"error": "Некорректный курсор"}), 400
+        with get_db() as conn:
+            return jsonify(load_sync_delta(conn, "tasks", TASK_FIELDS, since))
     with get_db() as conn:
         rows = conn.execute(
-            """
-            SELECT id, title, status, priority, assignee, deadline,
-                   created_by_name, created_by_login, created_by_role,
-                   created_at, updated_at
+            f"""
+            SELECT {TASK_FIELDS}
             FROM tasks
             ORDER BY updated_at DESC
             """
@@ -1792,7 +4046,7 @@ def create_task():
     created_at = datetime.utcnow().isoformat()
     actor = get_actor_snapshot()
     with get_db() as conn:
-        conn.execute(
+        cursor = conn.execute(
             """
             INSERT INTO tasks
             (title, status, priority, assignee, deadline,
@@ -1812,6 +4066,11 @@ def create_task():
                 created_at,
             ),
         )
+        task = conn.execute(
+            f"SELECT {TASK_FIELDS} FROM tasks WHERE id = ?",
+            (cursor.lastrowid,),
+        ).fetchone()
+        publish_change(conn, "tasks", "created", task["id"], dict(task))
     return jsonify({"ok": True})
 
 
@@ -1830,6 +4089,7 @@ def delete_task(task_id):
         if not can_manage_record(row["created_by_login"]):
             return jsonify({"error": "forbidden"}), 403
         conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+        publish_change(conn, "tasks", "deleted", task_id)
     return jsonify({"ok": True})
 
 
@@ -1838,12 +4098,19 @@ def list_knowledge():
     guard = require_page_access("knowledge", redirect_on_fail=False)
     if guard:
         return guard
+    guard = require_not_modified(["knowledge_items"])
+    if guard:
+        return guard
+    if "since" in request.args:
+        since = parse_sync_cursor()
+        if since is None:
+            return jsonify({"error": "Некорректный курсор"}), 400
+        with get_db() as conn:
+            return jsonify(load_sync_delta(conn, "knowledge_items", KNOWLEDGE_FIELDS, since))
     with get_db() as conn:
         rows = conn.execute(
-            """
-            SELECT id, title, section, owner, tag,
-                   created_by_name, created_by_login, created_by_role,
-                   created_at, updated_at
+            f"""
+            SELECT {KNOWLEDGE_FIELDS}
             FROM knowledge_items
             ORDER BY updated_at DESC
             """
@@ -1866,7 +4133,7 @@ def create_knowledge():
     created_at = datetime.utcnow().isoformat()
     actor = get_actor_snapshot()
     with get_db() as conn:
-        conn.execute(
+        cursor = conn.execute(
             """
             INSERT INTO knowledge_items
             (title, section, owner, tag,
@@ -1885,6 +4152,11 @@ def create_knowledge():
                 created_at,
             ),
         )
+        item = conn.execute(
+            f"SELECT {KNOWLEDGE_FIELDS} FROM knowledge_items WHERE id = ?",
+            (cursor.lastrowid,),
+        ).fetchone()
+        publish_change(conn, "knowledge", "created", item["id"], dict(item))
     return jsonify({"ok": True})
 
 
@@ -1903,12 +4175,16 @@ def delete_knowledge(item_id):
         if not can_manage_record(row["created_by_login"]):
             return jsonify({"error": "forbidden"}), 403
         conn.execute("DELETE FROM knowledge_items WHERE id = ?", (item_id,))
+        publish_change(conn, "knowledge", "deleted", item_id)
     return jsonify({"ok": True})
 
 
 @app.get("/api/bloggers")
 def list_bloggers():
     guard = require_page_access("bloggers", redirect_on_fail=False)
+    if guard:
+        return guard
+    guard = require_not_modified(["bloggers"])
     if guard:
         return guard
     with get_db() as conn:
@@ -2064,19 +4340,21 @@ def delete_blogger_integration(integration_id):
 @app.get("/api/locations")
 def get_locations():
     guard = require_page_access("locations", redirect_on_fail=False)
+    if guard:
+        return guard
+    guard = require_not_modified(["locations", "location_totals"])
     if guard:
         return guard
     with get_db() as conn:
         rows = conn.execute(
             """
             SELECT l.id, l.name, l.address,
-                   COALESCE(SUM(r.stock), 0) AS total_stock,
-                   COALESCE(SUM(r.sales_qty), 0) AS total_sales_qty,
-                   COALESCE(SUM(r.sales_amount), 0) AS total_sales_amount,
-                   MAX(r.created_at) AS last_update
+                   COALESCE(t.total_stock, 0) AS total_stock,
+                   COALESCE(t.total_sales_qty, 0) AS total_sales_qty,
+                   COALESCE(t.total_sales_amount, 0) AS total_sales_amount,
+                   t.last_update
             FROM locations l
-            LEFT JOIN records r ON r.location_id = l.id
-            GROUP BY l.id
+            LEFT JOIN location_totals t ON t.location_id = l.id
             ORDER BY l.created_at DESC
             """
         ).fetchall()
@@ -2104,23 +4382,181 @@ def add_location():
     return jsonify({"ok": True})
 
 
+def encode_records_cursor(row):
+    payload = json.dumps([row["sort_value"], row["id"]], ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_records_cursor(value):
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(value.encode("ascii")))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(sort_value, str) or not isinstance(row_id, int):
+        return None
+    return sort_value, row_id
+
+
 @app.get("/api/records/<int:location_id>")
 def get_records(location_id):
     guard = require_page_access("locations", redirect_on_fail=False)
     if guard:
         return guard
+    sort = request.args.get("sort", "created_at")
+    if sort not in RECORD_SORTS:
+        return jsonify({"error": "Некорректная сортировка"}), 400
+    sort_column, default_order, source = RECORD_SORTS[sort]
+    order = request.args.get("order", default_order)
+    if order not in ("asc", "desc"):
+        return jsonify({"error": "Некорректный порядок сортировки"}), 400
+    descending = order == "desc"
+    limit = min(max(request.args.get("limit", RECORDS_PAGE_SIZE, type=int), 1), RECORDS_PAGE_MAX)
+    conditions = ["records.location_id = ?"]
+    params = [location_id]
+    product = normalize_product_key(request.args.get("product") or "")
+    if product:
+        conditions.append(
+            "records.product_id IN (SELECT id FROM products WHERE instr(product_key, ?) > 0)"
+        )
+        params.append(product)
+    source_file = (request.args.get("source_file") or "").strip()
+    if source_file:
+        conditions.append("records.source_file = ?")
+        params.append(source_file)
+    try:
+        date_from = request.args.get("date_from")
+        if date_from:
+            conditions.append("records.created_at >= ?")
+            params.append(datetime.strptime(date_from, "%Y-%m-%d").isoformat())
+        date_to = request.args.get("date_to")
+        if date_to:
+            conditions.append("records.created_at < ?")
+            params.append((datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)).isoformat())
+    except ValueError:
+        return jsonify({"error": "Некорректная дата"}), 400
+    cursor = request.args.get("cursor")
+    if cursor:
+        position = decode_records_cursor(cursor)
+        if not position:
+            return jsonify({"error": "Некорректный курсор"}), 400
+        conditions.append(f"({sort_column}, records.id) {'<' if descending else '>'} (?, ?)")
+        params.extend(position)
+    direction = "DESC" if descending else "ASC"
     with get_db() as conn:
         rows = conn.execute(
-            """
-            SELECT id, product, stock, sales_qty, sales_amount, record_date, source_file, created_at
-            FROM records
-            WHERE location_id = ?
-            ORDER BY created_at DESC
-            """
-            ,
-            (location_id,),
+            f"""
+            SELECT records.id, products.display_name AS product, records.product_id,
+                   records.stock, records.sales_qty, records.sales_amount, records.record_date,
+                   records.source_file, records.created_at, {sort_column} AS sort_value
+            FROM {source}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY {sort_column} {direction}, records.id {direction}
+            LIMIT ?
+            """,
+            params + [limit + 1],
         ).fetchall()
-    return jsonify([dict(row) for row in rows])
+    next_cursor = encode_records_cursor(rows[limit - 1]) if len(rows) > limit else None
+    items = [
+        {key: row[key] for key in row.keys() if key != "sort_value"} for row in rows[:limit]
+    ]
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+
+@app.get("/api/analytics/sales")
+def sales_analytics():
+    guard = require_page_access("locations", redirect_on_fail=False)
+    if guard:
+        return guard
+    grain = request.args.get("grain", "day")
+    if grain not in SALES_GRAINS:
+        return jsonify({"error": "Некорректный период"}), 400
+    metric = request.args.get("metric", "sales_amount")
+    if metric not in {"sales_qty", "sales_amount"}:
+        return jsonify({"error": "Некорректный показатель"}), 400
+    group_by = [key.strip() for key in request.args.get("group_by", "period").split(",")]
+    if not group_by or any(key not in ANALYTICS_DIMENSIONS for key in group_by):
+        return jsonify({"error": "Некорректная группировка"}), 400
+    dimensions = [ANALYTICS_DIMENSIONS[key] for key in dict.fromkeys(group_by)]
+    top = request.args.get("top", type=int)
+    if top is not None and not 1 <= top <= ANALYTICS_TOP_MAX:
+        return jsonify({"error": f"top должен быть от 1 до {ANALYTICS_TOP_MAX}"}), 400
+    conditions = ["grain = ?"]
+    params = [grain]
+    try:
+        date_from = request.args.get("date_from")
+        if date_from:
+            day = datetime.strptime(date_from, "%Y-%m-%d").date().isoformat()
+            conditions.append("period >= ?")
+            params.append(sales_periods(day)[grain])
+        date_to = request.args.get("date_to")
+        if date_to:
+            conditions.append("period <= ?")
+            params.append(datetime.strptime(date_to, "%Y-%m-%d").date().isoformat())
+    except ValueError:
+        return jsonify({"error": "Некорректная дата"}), 400
+    location_id = request.args.get("location_id", type=int)
+    if location_id:
+        conditions.append("location_id = ?")
+        params.append(location_id)
+    product_id = request.args.get("product_id", type=int)
+    if product_id:
+        conditions.append("product_id = ?")
+        params.append(product_id)
+    product = normalize_product_key(request.args.get("product") or "")
+    if product:
+        conditions.append("product_id IN (SELECT id FROM products WHERE instr(product_key, ?) > 0)")
+        params.append(product)
+    guard = require_not_modified(["locations", "location_totals"])
+    if guard:
+        return guard
+    columns = ", ".join(dimensions)
+    aggregate = f"""
+        SELECT {columns}, SUM(sales_qty) AS sales_qty, SUM(sales_amount) AS sales_amount
+        FROM sales_rollups
+        WHERE {' AND '.join(conditions)}
+        GROUP BY {columns}
+    """
+    if top and "period" in dimensions and len(dimensions) > 1:
+        aggregate = f"""
+            SELECT * FROM (
+                SELECT totals.*, ROW_NUMBER() OVER (
+                    PARTITION BY period ORDER BY {metric} DESC
+                ) AS rank
+                FROM ({aggregate}) AS totals
+            )
+            WHERE rank <= ?
+        """
+        params.append(top)
+        order, limit = "totals.period, totals.rank", ""
+    elif top:
+        order, limit = f"totals.{metric} DESC", "LIMIT ?"
+        params.append(top)
+    else:
+        order, limit = ", ".join(f"totals.{column}" for column in dimensions), ""
+    joins = []
+    if "location_id" in dimensions:
+        joins.append("LEFT JOIN locations ON locations.id = totals.location_id")
+    if "product_id" in dimensions:
+        joins.append("LEFT JOIN products ON products.id = totals.product_id")
+    names = "".join(
+        [
+            ", locations.name AS location" if "location_id" in dimensions else "",
+            ", products.display_name AS product" if "product_id" in dimensions else "",
+        ]
+    )
+    with get_db() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT totals.*{names}
+            FROM ({aggregate}) AS totals
+            {' '.join(joins)}
+            ORDER BY {order}
+            {limit}
+            """,
+            params,
+        ).fetchall()
+    items = [{key: row[key] for key in row.keys() if key != "rank"} for row in rows]
+    return jsonify({"grain": grain, "metric": metric, "items": items})
 
 
 @app.delete("/api/locations/<int:location_id>")
@@ -2131,14 +4567,411 @@ def delete_location(location_id):
     guard = require_admin()
     if guard:
         return guard
-    with get_db() as conn:
+    with records_write_lock, get_db() as conn:
+        conn.execute(
+            """
+            UPDATE import_jobs
+            SET state = 'cancelled', error = ?, finished_at = ?
+            WHERE location_id = ? AND state IN ('queued', 'running')
+            """,
+            ("Точка продаж удалена", datetime.utcnow().isoformat(), location_id),
+        )
         conn.execute("DELETE FROM records WHERE location_id = ?", (location_id,))
+        conn.execute("DELETE FROM location_totals WHERE location_id = ?", (location_id,))
+        conn.execute("DELETE FROM current_stock WHERE location_id = ?", (location_id,))
+        conn.execute("DELETE FROM sales_rollups WHERE location_id = ?", (location_id,))
+        conn.execute("DELETE FROM import_batches WHERE location_id = ?", (location_id,))
         result = conn.execute("DELETE FROM locations WHERE id = ?", (location_id,))
         if result.rowcount == 0:
             return jsonify({"error": "Точка продаж не найдена"}), 404
+        publish_change(conn, "locations", "deleted", location_id)
+    export_cache.discard(f"location-{location_id}")
     return jsonify({"ok": True})
 
 
+IMPORT_WORKERS = int(os.environ.get("IMPORT_WORKERS", str(os.cpu_count() or 2)))
+IMPORT_WRITE_BATCH = int(os.environ.get("IMPORT_WRITE_BATCH", "8"))
+IMPORT_ZIP_MAX_MB = int(os.environ.get("IMPORT_ZIP_MAX_MB", "1000"))
+IMPORT_EXTENSIONS = (".xlsx", ".xlsm", ".xls", ".csv")
+IMPORT_JOB_FIELDS = """
+    id, location_id, filename, state, rows, skipped_rows, progress, error,
+    created_by_login, created_at, started_at, finished_at
+"""
+
+import_executor = None
+import_process_pool = None
+import_writer = None
+import_executor_lock = threading.Lock()
+import_location_queues = {}
+import_jobs_resumed = False
+import_write_queue = queue.Queue()
+records_write_lock = threading.Lock()
+
+
+class ImportCancelledError(Exception):
+    pass
+
+
+def ensure_import_job_active(conn, job_id):
+    # Runs under records_write_lock, like delete_location, so a job cancelled by a
+    # location delete never writes after it.
+    state = conn.execute("SELECT state FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+    if not state or state["state"] == "cancelled":
+        raise ImportCancelledError(job_id)
+
+
+def get_import_executor():
+    global import_executor
+    with import_executor_lock:
+        if import_executor is None:
+            import_executor = ThreadPoolExecutor(
+                max_workers=IMPORT_WORKERS, thread_name_prefix="import"
+            )
+        return import_executor
+
+
+def get_import_process_pool():
+    global import_process_pool
+    with import_executor_lock:
+        if import_process_pool is None:
+            import_process_pool = ProcessPoolExecutor(
+                max_workers=IMPORT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return import_process_pool
+
+
+def reset_import_process_pool(pool):
+    global import_process_pool
+    with import_executor_lock:
+        if import_process_pool is pool:
+            import_process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_import_write(fn, *args):
+    global import_writer
+    future = Future()
+    import_write_queue.put((future, fn, args))
+    with import_executor_lock:
+        if import_writer is None:
+            import_writer = threading.Thread(
+                target=import_writer_loop, name="import-writer", daemon=True
+            )
+            import_writer.start()
+    return future
+
+
+def import_writer_loop():
+    while True:
+        tasks = [import_write_queue.get()]
+        while len(tasks) < IMPORT_WRITE_BATCH:
+            try:
+                tasks.append(import_write_queue.get_nowait())
+            except queue.Empty:
+                break
+        done = []
+        try:
+            with records_write_lock, get_db() as conn:
+                for future, fn, args in tasks:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    conn.execute("SAVEPOINT import_write")
+                    try:
+                        result = fn(conn, *args)
+                    except Exception as exc:
+                        conn.execute("ROLLBACK TO import_write")
+                        conn.execute("RELEASE import_write")
+                        future.set_exception(exc)
+                        continue
+                    conn.execute("RELEASE import_write")
+                    done.append((future, result))
+        except Exception as exc:
+            logger.exception("Import write batch failed.")
+            for future, _, _ in tasks:
+                if not future.done():
+                    future.set_exception(exc)
+            continue
+        for future, result in done:
+            future.set_result(result)
+
+
+def enqueue_import_job(job_id):
+    with get_db() as conn:
+        job = conn.execute("SELECT location_id FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+    if not job:
+        return
+    location_id = job["location_id"]
+    with import_executor_lock:
+        pending = import_location_queues.get(location_id)
+        if pending is not None:
+            pending.append(job_id)
+            return
+        import_location_queues[location_id] = deque()
+    get_import_executor().submit(run_location_imports, location_id, job_id)
+
+
+def run_location_imports(location_id, job_id):
+    # Imports of one location run one after another; the next queued job is
+    # submitted only when the current one finishes, so waiting jobs never hold
+    # a pool thread.
+    try:
+        run_import_job(job_id)
+    finally:
+        with import_executor_lock:
+            pending = import_location_queues[location_id]
+            if not pending:
+                del import_location_queues[location_id]
+                return
+            job_id = pending.popleft()
+        get_import_executor().submit(run_location_imports, location_id, job_id)
+
+
+def update_import_job(conn, job_id, **fields):
+    assignments = ", ".join(f"{key} = ?" for key in fields)
+    conn.execute(
+        f"UPDATE import_jobs SET {assignments} WHERE id = ?",
+        (*fields.values(), job_id),
+    )
+
+
+def parse_import_file(path, spool_path, chunk_size=IMPORT_CHUNK_SIZE):
+    chunks, error = parse_excel_chunks(path, chunk_size)
+    if error:
+        return error
+    with open(spool_path, "wb") as spool:
+        for chunk in chunks:
+            pickle.dump(chunk, spool, protocol=pickle.HIGHEST_PROTOCOL)
+    return None
+
+
+def read_import_spool(spool_path):
+    with open(spool_path, "rb") as spool:
+        while True:
+            try:
+                yield pickle.load(spool)
+            except EOFError:
+                return
+
+
+def start_import_batch(conn, job, created_at):
+    ensure_import_job_active(conn, job["id"])
+    return create_import_batch(
+        conn, job["location_id"], job["filename"], created_at, job["id"], job["content_sha256"]
+    )
+
+
+def write_import_chunk(conn, job, data, created_at, batch_id, rows, fraction, diff):
+    ensure_import_job_active(conn, job["id"])
+    data = drop_known_rows(conn, job["location_id"], data, batch_id, diff)
+    inserted = insert_records(
+        conn, job["location_id"], data, job["filename"], created_at, job["id"], batch_id
+    )
+    update_import_job(conn, job["id"], rows=rows, progress=round(fraction, 3))
+    return inserted
+
+
+def finish_import_job_diff(conn, job, batch_id, diff):
+    ensure_import_job_active(conn, job["id"])
+    finalize_import_diff(conn, job["location_id"], batch_id, diff)
+    update_import_job(conn, job["id"], skipped_rows=diff["skipped"])
+
+
+def import_job_file(job):
+    pool = get_import_process_pool()
+    spool_path = f"{job['path']}.chunks"
+    try:
+        try:
+            error = pool.submit(parse_import_file, job["path"], spool_path).result()
+        except BrokenProcessPool:
+            reset_import_process_pool(pool)
+            raise
+        if error:
+            return 0, error
+        created_at = datetime.utcnow().isoformat()
+        batch_id = submit_import_write(start_import_batch, job, created_at).result()
+        diff = {"matched": set(), "keys": set(), "skipped": 0}
+        writes = deque()
+        inserted = 0
+        rows = 0
+        try:
+            for data, fraction in read_import_spool(spool_path):
+                rows += len(data)
+                writes.append(
+                    submit_import_write(
+                        write_import_chunk, job, data, created_at, batch_id, rows, fraction, diff
+                    )
+                )
+                if len(writes) > 2:
+                    inserted += writes.popleft().result()
+            inserted += sum(write.result() for write in writes)
+        except BaseException:
+            # Chunks still queued must land before run_import_job deletes the
+            # job's records, or they would be committed after the cleanup.
+            wait(writes)
+            raise
+        submit_import_write(finish_import_job_diff, job, batch_id, diff).result()
+        return inserted, None
+    finally:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+
+
+def run_import_job(job_id):
+    with get_db() as conn:
+        claimed = conn.execute(
+            """
+            UPDATE import_jobs SET state = 'running', started_at = ?, worker_pid = ?
+            WHERE id = ? AND state = 'queued'
+            """,
+            (datetime.utcnow().isoformat(), os.getpid(), job_id),
+        ).rowcount
+        job = conn.execute("SELECT * FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+    if not claimed:
+        return
+    try:
+        inserted, error = import_job_file(job)
+    except ImportCancelledError:
+        logger.info("Import job %s was cancelled.", job_id)
+        return
+    except Exception:
+        logger.exception("Import job %s failed.", job_id)
+        inserted, error = 0, "Ошибка импорта файла"
+    with records_write_lock, get_db() as conn:
+        try:
+            ensure_import_job_active(conn, job_id)
+        except ImportCancelledError:
+            return
+        if error:
+            delete_import_job_records(conn, job_id)
+        update_import_job(
+            conn,
+            job_id,
+            state="failed" if error else "done",
+            rows=inserted,
+            progress=0 if error else 1,
+            error=error,
+            finished_at=datetime.utcnow().isoformat(),
+        )
+
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def resume_import_jobs():
+    with records_write_lock, get_db() as conn:
+        rows = conn.execute(
+            """
+            SELECT id, state, worker_pid FROM import_jobs
+            WHERE state IN ('queued', 'running') ORDER BY id
+            """
+        ).fetchall()
+        queued = []
+        for row in rows:
+            if row["state"] == "running":
+                pid = row["worker_pid"]
+                if pid and pid != os.getpid() and is_process_alive(pid):
+                    continue
+                delete_import_job_records(conn, row["id"])
+                update_import_job(
+                    conn, row["id"], state="queued", rows=0, progress=0, worker_pid=None
+                )
+            queued.append(row["id"])
+    for job_id in queued:
+        enqueue_import_job(job_id)
+
+
+def resume_import_jobs_once():
+    global import_jobs_resumed
+    with import_executor_lock:
+        if import_jobs_resumed:
+            return
+        import_jobs_resumed = True
+    try:
+        resume_import_jobs()
+    except Exception:
+        logger.exception("Failed to resume import jobs.")
+
+
+# Resumed on the first request rather than at import time: CLI commands and the
+# debug reloader's parent process never serve requests, so they leave jobs alone.
+app.before_request(resume_import_jobs_once)
+
+
+def serialize_import_job(row):
+    job = dict(row)
+    started_at = _parse_iso_timestamp(job["started_at"])
+    finished_at = _parse_iso_timestamp(job["finished_at"]) or datetime.utcnow()
+    elapsed = (finished_at - started_at).total_seconds() if started_at else 0
+    job["elapsed_seconds"] = round(elapsed, 3)
+    job["rows_per_second"] = round(job["rows"] / elapsed, 1) if elapsed > 0 else None
+    return job
+
+
+def new_upload_path(filename):
+    stem, extension = os.path.splitext(filename)
+    stored_name = f"{secure_filename(stem) or 'upload'}{extension.lower()}"
+    return os.path.join(app.config["UPLOAD_DIR"], f"{uuid.uuid4().hex}_{stored_name}")
+
+
+def save_upload(source, path):
+    digest = sha256()
+    with open(path, "wb") as target:
+        for block in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(block)
+            target.write(block)
+    return digest.hexdigest()
+
+
+def find_duplicate_import(conn, location_id, digest):
+    return conn.execute(
+        """
+        SELECT 1 FROM import_batches WHERE location_id = ? AND content_sha256 = ?
+        UNION ALL
+        SELECT 1 FROM import_jobs
+        WHERE location_id = ? AND content_sha256 = ? AND state IN ('queued', 'running')
+        LIMIT 1
+        """,
+        (location_id, digest, location_id, digest),
+    ).fetchone()
+
+
+def create_import_job(conn, location_id, filename, path, digest, created_at):
+    # Take the write lock before the duplicate check so two identical uploads
+    # arriving together cannot both pass it.
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    duplicate = find_duplicate_import(conn, location_id, digest) is not None
+    if duplicate:
+        os.remove(path)
+    cursor = conn.execute(
+        """
+        INSERT INTO import_jobs
+        (location_id, filename, path, created_by_login, created_at, content_sha256,
+         state, progress, finished_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            location_id,
+            filename,
+            "" if duplicate else path,
+            get_profile_login(),
+            created_at,
+            digest,
+            "skipped" if duplicate else "queued",
+            1 if duplicate else 0,
+            created_at if duplicate else None,
+        ),
+    )
+    return cursor.lastrowid, duplicate
+
+
 @app.post("/api/upload")
 def upload_file():
     guard = require_page_access("locations", redirect_on_fail=False)
@@ -2156,32 +4989,449 @@ def upload_file():
     filename = secure_filename(file.filename)
     if not filename:
         return jsonify({"error": "Неверное имя файла"}), 400
-    path = os.path.join(app.config["UPLOAD_DIR"], filename)
-    file.save(path)
-    data, error = parse_excel(path)
+    with get_db() as conn:
+        location = conn.execute(
+            "SELECT id FROM locations WHERE id = ?", (location_id,)
+        ).fetchone()
+    if not location:
+        return jsonify({"error": "Точка продаж не найдена"}), 404
+    path = new_upload_path(file.filename)
+    digest = save_upload(file.stream, path)
+    with get_db() as conn:
+        job_id, duplicate = create_import_job(
+            conn, location_id, filename, path, digest, datetime.utcnow().isoformat()
+        )
+    if duplicate:
+        return jsonify({"ok": True, "job_id": job_id, "duplicate": True})
+    enqueue_import_job(job_id)
+    return jsonify({"ok": True, "job_id": job_id}), 202
+
+
+def is_import_file(filename):
+    return (
+        bool(filename)
+        and not filename.startswith(".")
+        and filename.lower().endswith(IMPORT_EXTENSIONS)
+    )
+
+
+def extract_import_archive(file, saved):
+    with zipfile.ZipFile(file) as archive:
+        members = [
+            member
+            for member in archive.infolist()
+            if not member.is_dir()
+            and "__MACOSX" not in member.filename
+            and is_import_file(os.path.basename(member.filename))
+        ]
+        if sum(member.file_size for member in members) > IMPORT_ZIP_MAX_MB * 1024 * 1024:
+            return f"Архив больше {IMPORT_ZIP_MAX_MB} МБ после распаковки"
+        for member in members:
+            filename = os.path.basename(member.filename)
+            path = new_upload_path(filename)
+            with archive.open(member) as source:
+                saved.append((filename, path, save_upload(source, path)))
+    return None
+
+
+def resolve_import_locations(conn, filenames, mapping):
+    locations = conn.execute("SELECT id, name FROM locations").fetchall()
+    known_ids = {row["id"] for row in locations}
+    by_name = {" ".join((row["name"] or "").split()).casefold(): row["id"] for row in locations}
+    resolved = {}
+    for filename in filenames:
+        location_id = mapping.get(filename)
+        if location_id is None:
+            stem = os.path.splitext(filename)[0]
+            location_id = by_name.get(" ".join(stem.split()).casefold())
+        resolved[filename] = location_id
+    unmapped = [name for name, location_id in resolved.items() if location_id is None]
+    if unmapped:
+        return None, f"Не удалось определить точку для файлов: {', '.join(unmapped)}"
+    unknown = sorted(
+        {str(location_id) for location_id in resolved.values() if location_id not in known_ids}
+    )
+    if unknown:
+        return None, f"Точка продаж не найдена: {', '.join(unknown)}"
+    return resolved, None
+
+
+@app.post("/api/upload/batch")
+def upload_batch():
+    guard = require_page_access("locations", redirect_on_fail=False)
+    if guard:
+        return guard
+    guard = require_admin()
+    if guard:
+        return guard
+    try:
+        mapping = json.loads(request.form.get("mapping") or "{}")
+        mapping = {str(name): int(location_id) for name, location_id in mapping.items()}
+    except (ValueError, TypeError, AttributeError):
+        return jsonify({"error": "Некорректное сопоставление файлов и точек"}), 400
+    files = [file for file in request.files.getlist("files") if file.filename]
+    if not files:
+        return jsonify({"error": "Файлы не найдены"}), 400
+    saved = []
+    error = None
+    try:
+        for file in files:
+            filename = os.path.basename(file.filename.replace("\\", "/"))
+            if filename.lower().endswith(".zip"):
+                error = extract_import_archive(file.stream, saved)
+            elif is_import_file(filename):
+                path = new_upload_path(filename)
+                saved.append((filename, path, save_upload(file.stream, path)))
+            else:
+                error = f"Неподдерживаемый файл: {filename}"
+            if error:
+                break
+    except zipfile.BadZipFile:
+        error = "Архив поврежден"
+    if not error and not saved:
+        error = "В архиве нет файлов для импорта"
+    if not error and len({filename for filename, _, _ in saved}) != len(saved):
+        error = "Имена файлов в пакете повторяются"
+    resolved = None
+    if not error:
+        with get_db() as conn:
+            resolved, error = resolve_import_locations(
+                conn, [filename for filename, _, _ in saved], mapping
+            )
     if error:
+        for _, path, _ in saved:
+            if os.path.exists(path):
+                os.remove(path)
         return jsonify({"error": error}), 400
+    jobs = []
+    created_at = datetime.utcnow().isoformat()
     with get_db() as conn:
-        for _, row in data.iterrows():
-            conn.execute(
-                """
-                INSERT INTO records
-                (location_id, product, stock, sales_qty, sales_amount, record_date, source_file, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """
-                ,
-                (
-                    location_id,
-                    str(row["product"]),
-                    int(row["stock"]) if pd.notna(row["stock"]) else None,
-                    int(row["sales_qty"]) if pd.notna(row["sales_qty"]) else None,
-                    float(row["sales_amount"]) if pd.notna(row["sales_amount"]) else None,
-                    str(row["record_date"]) if pd.notna(row["record_date"]) else None,
-                    filename,
-                    datetime.utcnow().isoformat(),
-                ),
+        for filename, path, digest in saved:
+            job_id, duplicate = create_import_job(
+                conn, resolved[filename], filename, path, digest, created_at
             )
-    return jsonify({"ok": True})
+            jobs.append(
+                {
+                    "job_id": job_id,
+                    "filename": filename,
+                    "location_id": resolved[filename],
+                    "duplicate": duplicate,
+                }
+            )
+    for job in jobs:
+        if not job["duplicate"]:
+            enqueue_import_job(job["job_id"])
+    return jsonify({"ok": True, "jobs": jobs}), 202
+
+
+@app.get("/api/imports")
+def list_import_jobs():
+    guard = require_page_access("locations", redirect_on_fail=False)
+    if guard:
+        return guard
+    location_id = request.args.get("location_id", type=int)
+    with get_db() as conn:
+        if location_id:
+            rows = conn.execute(
+                f"""
+                SELECT {IMPORT_JOB_FIELDS} FROM import_jobs
+                WHERE location_id = ?
+                ORDER BY id DESC LIMIT 50
+                """,
+                (location_id,),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                f"SELECT {IMPORT_JOB_FIELDS} FROM import_jobs ORDER BY id DESC LIMIT 50"
+            ).fetchall()
+    return jsonify([serialize_import_job(row) for row in rows])
+
+
+@app.get("/api/imports/<int:job_id>")
+def get_import_job(job_id):
+    guard = require_page_access("locations", redirect_on_fail=False)
+    if guard:
+        return guard
+    with get_db() as conn:
+        row = conn.execute(
+            f"SELECT {IMPORT_JOB_FIELDS} FROM import_jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+    if not row:
+        return jsonify({"error": "Импорт не найден"}), 404
+    return jsonify(serialize_import_job(row))
+
+
+EXPORT_COLUMNS = [
+    "product",
+    "stock",
+    "sales_qty",
+    "sales_amount",
+    "record_date",
+    "source_file",
+    "created_at",
+]
+EXPORT_RECORDS_SQL = """
+    SELECT products.display_name AS product, records.stock, records.sales_qty,
+           records.sales_amount, records.record_date, records.source_file, records.created_at
+    FROM records
+    JOIN products ON products.id = records.product_id
+    WHERE records.location_id = ?
+    ORDER BY records.created_at DESC
+"""
+EXPORT_ALL_RECORDS_SQL = """
+    SELECT records.location_id, locations.name AS location,
+           products.display_name AS product, records.stock, records.sales_qty,
+           records.sales_amount, records.record_date, records.source_file, records.created_at
+    FROM records
+    JOIN locations ON locations.id = records.location_id
+    JOIN products ON products.id = records.product_id
+    ORDER BY records.location_id DESC, records.created_at DESC
+"""
+EXPORT_FORMATS = {"xlsx", "csv", "parquet"}
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "50000"))
+EXPORT_CSV_FLUSH_BYTES = 256 * 1024
+
+
+def export_sheet_name(location, used):
+    base = re.sub(r"[\[\]:*?/\\]", " ", location["name"] or "").strip()
+    base = base or f"Локация {location['id']}"
+    name = base[:31]
+    suffix = 2
+    while name.casefold() in used:
+        tail = f" ({suffix})"
+        name = base[: 31 - len(tail)] + tail
+        suffix += 1
+    used.add(name.casefold())
+    return name
+
+
+def write_records_workbook(conn, locations, path):
+    workbook = openpyxl.Workbook(write_only=True)
+    used = set()
+    for location in locations:
+        sheet = workbook.create_sheet(title=export_sheet_name(location, used))
+        sheet.append(EXPORT_COLUMNS)
+        for row in conn.execute(EXPORT_RECORDS_SQL, (location["id"],)):
+            sheet.append(tuple(row))
+    if not locations:
+        workbook.create_sheet(title="Записи").append(EXPORT_COLUMNS)
+    workbook.save(path)
+
+
+class ExportCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def _path(self, scope, key, suffix):
+        return os.path.join(self.directory, f"{scope}.{key}{suffix}")
+
+    def _entries(self, prefix=""):
+        with os.scandir(self.directory) as entries:
+            return [
+                entry
+                for entry in entries
+                if entry.is_file() and entry.name.startswith(prefix)
+            ]
+
+    def open(self, scope, key, suffix):
+        path = self._path(scope, key, suffix)
+        with self.lock:
+            try:
+                handle = open(path, "rb")
+            except FileNotFoundError:
+                return None
+            os.utime(path)
+        return handle
+
+    def store(self, scope, key, suffix, source):
+        path = self._path(scope, key, suffix)
+        with self.lock:
+            for entry in self._entries(f"{scope}."):
+                if entry.name.endswith(suffix):
+                    with suppress(FileNotFoundError):
+                        os.remove(entry.path)
+            os.replace(source, path)
+            handle = open(path, "rb")
+            self._evict(keep=path)
+        return handle
+
+    def discard(self, scope):
+        with self.lock:
+            for entry in self._entries(f"{scope}."):
+                with suppress(FileNotFoundError):
+                    os.remove(entry.path)
+
+    def _evict(self, keep):
+        entries = sorted(
+            (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+            for entry in self._entries()
+        )
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            with suppress(FileNotFoundError):
+                os.remove(path)
+            total -= size
+
+
+export_cache = ExportCache(EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_MB * 1024 * 1024)
+
+
+def export_revision_key(conn):
+    revisions = get_table_revisions(conn, ["locations", "location_totals"])
+    key = "|".join(f"{row['table_name']}:{row['revision']}" for row in revisions)
+    return sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def begin_export_snapshot(conn):
+    # One read transaction for the key and the rows: an import committing in
+    # between must not get newer data stored under an older key.
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    return export_revision_key(conn)
+
+
+def new_export_path(suffix):
+    return os.path.join(EXPORT_DIR, f"{uuid.uuid4().hex}{suffix}")
+
+
+def export_response(scope, suffix, download_name, write):
+    with get_db() as conn:
+        key = export_revision_key(conn)
+    handle = export_cache.open(scope, key, suffix) if EXPORT_CACHE_MAX_MB else None
+    if handle is None:
+        path = new_export_path(suffix)
+        try:
+            with get_db() as conn:
+                key = begin_export_snapshot(conn)
+                write(conn, path)
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        if EXPORT_CACHE_MAX_MB:
+            handle = export_cache.store(scope, key, suffix, path)
+        else:
+            handle = open(path, "rb")
+            os.remove(path)
+    response = send_file(handle, as_attachment=True, download_name=download_name)
+    response.content_length = os.fstat(handle.fileno()).st_size
+    return response
+
+
+def write_all_locations_workbook(conn, path):
+    locations = conn.execute("SELECT id, name FROM locations ORDER BY name").fetchall()
+    write_records_workbook(conn, locations, path)
+
+
+def parquet_schema():
+    return pa.schema(
+        [
+            ("product", pa.string()),
+            ("stock", pa.int64()),
+            ("sales_qty", pa.int64()),
+            ("sales_amount", pa.float64()),
+            ("record_date", pa.string()),
+            ("source_file", pa.string()),
+            ("created_at", pa.string()),
+        ]
+    )
+
+
+def write_records_parquet(conn, location_id, path):
+    schema = parquet_schema()
+    cursor = conn.execute(EXPORT_RECORDS_SQL, (location_id,))
+    with pq.ParquetWriter(path, schema) as writer:
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            writer.write_table(
+                pa.table(
+                    {name: list(values) for name, values in zip(schema.names, columns)},
+                    schema=schema,
+                )
+            )
+
+
+def write_all_locations_parquet(conn, path):
+    location_ids = [row["id"] for row in conn.execute("SELECT id FROM locations ORDER BY id")]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as archive:
+        for location_id in location_ids:
+            part_path = new_export_path(".parquet")
+            try:
+                write_records_parquet(conn, location_id, part_path)
+                archive.write(part_path, f"location_id={location_id}/part-0.parquet")
+            finally:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+
+
+def iter_csv_gzip(conn, sql, params):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    cursor = conn.execute(sql, params)
+    writer.writerow([column[0] for column in cursor.description])
+    for row in cursor:
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CSV_FLUSH_BYTES:
+            chunk = compressor.compress(buffer.getvalue().encode("utf-8"))
+            buffer.seek(0)
+            buffer.truncate()
+            if chunk:
+                yield chunk
+    yield compressor.compress(buffer.getvalue().encode("utf-8")) + compressor.flush()
+
+
+def stream_csv_export(scope, download_name, sql, params):
+    with get_db() as conn:
+        key = export_revision_key(conn)
+    handle = export_cache.open(scope, key, ".csv.gz") if EXPORT_CACHE_MAX_MB else None
+    if handle is not None:
+        response = send_file(handle, as_attachment=True, download_name=download_name)
+        response.content_length = os.fstat(handle.fileno()).st_size
+        return response
+
+    def generate():
+        path = new_export_path(".csv.gz")
+        try:
+            with open(path, "wb") as spool, get_db() as conn:
+                snapshot_key = begin_export_snapshot(conn)
+                for chunk in iter_csv_gzip(conn, sql, params):
+                    spool.write(chunk)
+                    yield chunk
+            if EXPORT_CACHE_MAX_MB:
+                export_cache.store(scope, snapshot_key, ".csv.gz", path).close()
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    fallback_name = download_name.encode("ascii", "ignore").decode("ascii")
+    disposition = (
+        f'attachment; filename="{fallback_name}"; '
+        f"filename*=UTF-8''{quote(download_name)}"
+    )
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/gzip",
+        headers={"Content-Disposition": disposition},
+    )
+
+
+def check_export_format(export_format):
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "Некорректный формат выгрузки"}), 400
+    if export_format == "parquet" and pq is None:
+        return jsonify({"error": "Выгрузка в Parquet недоступна: не установлен pyarrow"}), 400
+    return None
 
 
 @app.get("/api/export")
@@ -2189,40 +5439,26 @@ def export_excel():
     guard = require_page_access("locations", redirect_on_fail=False)
     if guard:
         return guard
-    with get_db() as conn:
-        locations = conn.execute("SELECT id, name FROM locations ORDER BY name").fetchall()
-        export_path = os.path.join(DATA_DIR, "export.xlsx")
-        with pd.ExcelWriter(export_path, engine="openpyxl") as writer:
-            for location in locations:
-                records = conn.execute(
-                    """
-                    SELECT product, stock, sales_qty, sales_amount, record_date, source_file, created_at
-                    FROM records
-                    WHERE location_id = ?
-                    ORDER BY created_at DESC
-                    """
-                    ,
-                    (location["id"],),
-                ).fetchall()
-                df = pd.DataFrame(records)
-                if df.empty:
-                    df = pd.DataFrame(columns=[
-                        "product",
-                        "stock",
-                        "sales_qty",
-                        "sales_amount",
-                        "record_date",
-                        "source_file",
-                        "created_at",
-                    ])
-                sheet_name = location["name"][:31] if location["name"] else f"Локация {location['id']}"
-                df.to_excel(writer, index=False, sheet_name=sheet_name)
-    return send_file(export_path, as_attachment=True, download_name="crm_export.xlsx")
+    export_format = request.args.get("format", "xlsx")
+    guard = check_export_format(export_format)
+    if guard:
+        return guard
+    if export_format == "csv":
+        return stream_csv_export("all", "crm_export.csv.gz", EXPORT_ALL_RECORDS_SQL, ())
+    if export_format == "parquet":
+        return export_response(
+            "all", ".parquet.zip", "crm_export_parquet.zip", write_all_locations_parquet
+        )
+    return export_response("all", ".xlsx", "crm_export.xlsx", write_all_locations_workbook)
 
 
 @app.get("/api/export/<int:location_id>")
 def export_location_excel(location_id):
     guard = require_page_access("locations", redirect_on_fail=False)
+    if guard:
+        return guard
+    export_format = request.args.get("format", "xlsx")
+    guard = check_export_format(export_format)
     if guard:
         return guard
     with get_db() as conn:
@@ -2230,44 +5466,36 @@ def export_location_excel(location_id):
             "SELECT id, name FROM locations WHERE id = ?",
             (location_id,),
         ).fetchone()
-        if not location:
-            return jsonify({"error": "Точка продаж не найдена"}), 404
-        records = conn.execute(
-            """
-            SELECT product, stock, sales_qty, sales_amount, record_date, source_file, created_at
-            FROM records
-            WHERE location_id = ?
-            ORDER BY created_at DESC
-            """,
-            (location_id,),
-        ).fetchall()
-        df = pd.DataFrame(records)
-        if df.empty:
-            df = pd.DataFrame(
-                columns=[
-                    "product",
-                    "stock",
-                    "sales_qty",
-                    "sales_amount",
-                    "record_date",
-                    "source_file",
-                    "created_at",
-                ]
-            )
-        export_path = os.path.join(DATA_DIR, f"export_{location_id}.xlsx")
-        sheet_name = (
-            location["name"][:31] if location["name"] else f"Локация {location_id}"
-        )
-        with pd.ExcelWriter(export_path, engine="openpyxl") as writer:
-            df.to_excel(writer, index=False, sheet_name=sheet_name)
+    if not location:
+        return jsonify({"error": "Точка продаж не найдена"}), 404
     safe_name = re.sub(r"[^\wа-яА-Я-]+", "_", location["name"] or "location").strip("_")
-    download_name = f"crm_export_{safe_name or location_id}.xlsx"
-    return send_file(export_path, as_attachment=True, download_name=download_name)
+    download_name = f"crm_export_{safe_name or location_id}"
+    scope = f"location-{location_id}"
+    if export_format == "csv":
+        return stream_csv_export(
+            scope, f"{download_name}.csv.gz", EXPORT_RECORDS_SQL, (location_id,)
+        )
+    if export_format == "parquet":
+        return export_response(
+            scope,
+            ".parquet",
+            f"{download_name}.parquet",
+            lambda conn, path: write_records_parquet(conn, location_id, path),
+        )
+    return export_response(
+        scope,
+        ".xlsx",
+        f"{download_name}.xlsx",
+        lambda conn, path: write_records_workbook(conn, [location], path),
+    )
 
 
 @app.get("/api/shipments")
 def get_shipments():
     guard = require_page_access("locations", redirect_on_fail=False)
+    if guard:
+        return guard
+    guard = require_not_modified(["shipments"])
     if guard:
         return guard
     with get_db() as conn:
@@ -2306,13 +5534,14 @@ def add_shipment():
     if not origin_label or not destination_label or not display_number:
         return jsonify({"error": "Заполните все поля поставки"}), 400
     cdek_state = None
+    created_at = datetime.utcnow().isoformat()
     with get_db() as conn:
-        conn.execute(
+        cursor = conn.execute(
             """
             INSERT INTO shipments
             (origin_label, destination_label, internal_number, display_number, cdek_number, cdek_uuid, cdek_state,
-             last_status, last_location, last_update, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+             last_status, last_location, last_update, next_poll_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
             (
                 origin_label,
@@ -2325,9 +5554,15 @@ def add_shipment():
                 None,
                 None,
                 None,
-                datetime.utcnow().isoformat(),
+                created_at if cdek_number else None,
+                created_at,
             ),
         )
+        shipment = conn.execute(
+            f"SELECT {SHIPMENT_FIELDS} FROM shipments WHERE id = ?",
+            (cursor.lastrowid,),
+        ).fetchone()
+        publish_change(conn, "shipments", "created", shipment["id"], dict(shipment))
     return jsonify({"ok": True})
 
 
@@ -2348,6 +5583,36 @@ def shipment_history(id):
     return jsonify([dict(row) for row in rows])
 
 
+SHIPMENT_FIELDS = """
+    id, origin_label, destination_label, internal_number, display_number,
+    cdek_state, last_status, last_location, last_update, created_at
+"""
+
+
+def load_shipments_with_history(conn, shipment_ids):
+    placeholders = ", ".join("?" for _ in shipment_ids)
+    shipments = conn.execute(
+        f"""
+        SELECT {SHIPMENT_FIELDS} FROM shipments
+        WHERE id IN ({placeholders})
+        ORDER BY created_at DESC
+        """,
+        shipment_ids,
+    ).fetchall()
+    history = {shipment_id: [] for shipment_id in shipment_ids}
+    rows = conn.execute(
+        f"""
+        SELECT * FROM shipment_status_history
+        WHERE shipment_id IN ({placeholders})
+        ORDER BY shipment_id, timestamp DESC
+        """,
+        shipment_ids,
+    ).fetchall()
+    for row in rows:
+        history[row["shipment_id"]].append(dict(row))
+    return [dict(row) for row in shipments], history
+
+
 @app.post("/api/shipments/<int:shipment_id>/refresh")
 def refresh_shipment(shipment_id):
     guard = require_page_access("locations", redirect_on_fail=False)
@@ -2358,36 +5623,56 @@ def refresh_shipment(shipment_id):
             "SELECT * FROM shipments WHERE id = ?",
             (shipment_id,),
         ).fetchone()
-        if not shipment:
-            return jsonify({"error": "Поставка не найдена"}), 404
-        if not shipment["cdek_number"]:
-            return jsonify({"error": "У поставки нет трек-номера CDEK"}), 400
-        update_shipment_from_cdek(conn, shipment)
-        updated = conn.execute(
-            """
-            SELECT id, origin_label, destination_label, internal_number, display_number,
-                   cdek_state, last_status, last_location, last_update, created_at
-            FROM shipments
-            WHERE id = ?
-            """,
-            (shipment_id,),
-        ).fetchone()
-        history = conn.execute(
-            """
-            SELECT * FROM shipment_status_history
-            WHERE shipment_id = ?
-            ORDER BY timestamp DESC
-            """,
-            (shipment_id,),
-        ).fetchall()
+    if not shipment:
+        return jsonify({"error": "Поставка не найдена"}), 404
+    if not shipment["cdek_number"]:
+        return jsonify({"error": "У поставки нет трек-номера CDEK"}), 400
+    refresh_cdek_shipments([shipment])
+    with get_db() as conn:
+        shipments, history = load_shipments_with_history(conn, [shipment_id])
     return jsonify(
         {
-            "shipment": dict(updated),
-            "history": [dict(row) for row in history],
+            "shipment": shipments[0],
+            "history": history[shipment_id],
         }
     )
 
 
+@app.post("/api/shipments/refresh")
+def refresh_shipments_bulk():
+    guard = require_page_access("locations", redirect_on_fail=False)
+    if guard:
+        return guard
+    payload = request.get_json() or {}
+    ids = payload.get("ids")
+    with get_db() as conn:
+        if payload.get("stale"):
+            shipments = get_due_shipments(conn, datetime.utcnow())
+        elif isinstance(ids, list) and ids:
+            try:
+                ids = sorted({int(value) for value in ids})
+            except (TypeError, ValueError):
+                return jsonify({"error": "Некорректный список поставок"}), 400
+            if len(ids) > CDEK_SWEEP_LIMIT:
+                return jsonify({"error": "Слишком много поставок в одном запросе"}), 400
+            placeholders = ", ".join("?" for _ in ids)
+            shipments = conn.execute(
+                f"SELECT * FROM shipments WHERE id IN ({placeholders})",
+                ids,
+            ).fetchall()
+        else:
+            return jsonify({"error": "Укажите поставки для обновления"}), 400
+    shipments = [row for row in shipments if row["cdek_number"]]
+    if not shipments:
+        return jsonify({"shipments": [], "history": {}, "updated": 0})
+    updated = refresh_cdek_shipments(shipments)
+    with get_db() as conn:
+        refreshed, history = load_shipments_with_history(
+            conn, [row["id"] for row in shipments]
+        )
+    return jsonify({"shipments": refreshed, "history": history, "updated": updated})
+
+
 @app.delete("/api/shipments/<int:shipment_id>")
 def delete_shipment(shipment_id):
     guard = require_page_access("locations", redirect_on_fail=False)
@@ -2403,24 +5688,89 @@ def delete_shipment(shipment_id):
         )
         if result.rowcount == 0:
             return jsonify({"error": "Поставка не найдена"}), 404
+        conn.execute(
+            "DELETE FROM shipment_status_events WHERE shipment_id = ?",
+            (shipment_id,),
+        )
+        publish_change(conn, "shipments", "deleted", shipment_id)
     return jsonify({"ok": True})
 
 
+@app.post("/api/cdek/webhook")
+def cdek_webhook():
+    # CDEK webhooks carry no custom headers, so the subscription URL passes the
+    # token as a query parameter; access logs redact it (RedactWebhookTokenFilter).
+    token = request.headers.get("X-Webhook-Token") or request.args.get("token") or ""
+    if not CDEK_WEBHOOK_SECRET or not hmac.compare_digest(
+        token.encode("utf-8"), CDEK_WEBHOOK_SECRET.encode("utf-8")
+    ):
+        return jsonify({"error": "forbidden"}), 403
+    event = parse_cdek_webhook(request.get_json(silent=True))
+    if not event:
+        return jsonify({"error": "Некорректное уведомление"}), 400
+    with get_db() as conn:
+        result = ingest_cdek_webhook(conn, event)
+    return jsonify({"ok": True, **result})
+
+
+async def _manage_cdek_webhooks(method, url, **kwargs):
+    token = await cdek_auth_manager.get_token()
+    if not token:
+        raise click.ClickException("Не удалось получить токен CDEK.")
+    response = await cdek_request(
+        method, url, headers={"Authorization": f"Bearer {token}"}, **kwargs
+    )
+    response.raise_for_status()
+    return response.json() if response.content else {}
+
+
+@app.cli.command("cdek-webhooks")
+@click.argument("action", type=click.Choice(["list", "subscribe", "unsubscribe"]))
+@click.argument("target", required=False)
+def cdek_webhooks_command(action, target):
+    """List CDEK webhooks, subscribe a public base URL, or unsubscribe by uuid."""
+    init_db()
+    if action == "list":
+        result = run_cdek_coroutine(_manage_cdek_webhooks("GET", CDEK_WEBHOOKS_URL))
+    elif action == "subscribe":
+        if not target or not CDEK_WEBHOOK_SECRET:
+            raise click.UsageError("Укажите публичный адрес CRM и CDEK_WEBHOOK_SECRET.")
+        url = (
+            f"{target.rstrip('/')}/api/cdek/webhook?token={quote(CDEK_WEBHOOK_SECRET, safe='')}"
+        )
+        result = run_cdek_coroutine(
+            _manage_cdek_webhooks(
+                "POST", CDEK_WEBHOOKS_URL, json={"type": "ORDER_STATUS", "url": url}
+            )
+        )
+    else:
+        if not target:
+            raise click.UsageError("Укажите uuid подписки.")
+        result = run_cdek_coroutine(
+            _manage_cdek_webhooks("DELETE", f"{CDEK_WEBHOOKS_URL}/{target}")
+        )
+    click.echo(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+@app.get("/api/cdek/metrics")
+def cdek_metrics_view():
+    guard = require_admin()
+    if guard:
+        return guard
+    return jsonify(get_cdek_metrics())
+
+
 def cdek_updater_loop():
     while True:
         try:
             with get_db() as conn:
-                shipments = conn.execute(
-                    "SELECT * FROM shipments WHERE cdek_number IS NOT NULL"
-                ).fetchall()
-                now = datetime.utcnow()
-                for shipment in shipments:
-                    if not _should_update_cdek_status(shipment, now):
-                        continue
-                    update_shipment_from_cdek(conn, shipment)
+                due = get_due_shipments(conn, datetime.utcnow())
+            if due:
+                updated = refresh_cdek_shipments(due, CDEK_CALL_TIMEOUT)
+                logger.info("CDEK sweep refreshed %s of %s due shipments.", updated, len(due))
         except Exception:
             logger.exception("Failed to update CDEK statuses.")
-        time.sleep(CDEK_UPDATE_INTERVAL)
+        time.sleep(CDEK_SCHEDULER_TICK)
 
 
 if __name__ == "__main__":
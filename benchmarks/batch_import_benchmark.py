@@ -0,0 +1,121 @@
+"""Batch import benchmark: files imported one by one vs. the process-pool pipeline.
+
+The sequential path parses and inserts each file in the calling thread, the way
+single uploads used to run. The pipeline path enqueues every file as an import
+job: workers parse in separate processes and one writer thread inserts.
+
+Usage:
+    python benchmarks/batch_import_benchmark.py --files 8 --rows 20000 --workers 4
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def build_files(directory, files, rows):
+    rng = np.random.default_rng(11)
+    paths = []
+    for index in range(files):
+        path = os.path.join(directory, f"point_{index + 1}.xlsx")
+        pd.DataFrame(
+            {
+                "Номенклатура": [f"Товар {idx % 3000}" for idx in range(rows)],
+                "Остаток": rng.integers(0, 500, rows),
+                "Продажи": rng.integers(0, 50, rows),
+                "Сумма": rng.random(rows) * 10000,
+                "Дата": "2024-01-31",
+            }
+        ).to_excel(path, index=False)
+        paths.append(path)
+    return paths
+
+
+def create_jobs(crm, paths):
+    job_ids = []
+    with crm.get_db() as conn:
+        for index, path in enumerate(paths):
+            location_id = conn.execute(
+                "INSERT INTO locations (name, created_at) VALUES (?, ?)",
+                (f"Точка {index + 1}", "2024-01-01T00:00:00"),
+            ).lastrowid
+            job_ids.append(
+                conn.execute(
+                    """
+                    INSERT INTO import_jobs (location_id, filename, path, created_at)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (location_id, os.path.basename(path), path, "2024-01-01T00:00:00"),
+                ).lastrowid
+            )
+    return job_ids
+
+
+def sequential(crm, paths):
+    for job_id in create_jobs(crm, paths):
+        with crm.get_db() as conn:
+            job = conn.execute("SELECT * FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+        chunks, error = crm.parse_excel_chunks(job["path"])
+        created_at = "2024-02-01T00:00:00"
+        for data, _ in chunks:
+            with crm.get_db() as conn:
+                crm.insert_records(
+                    conn, job["location_id"], data, job["filename"], created_at, job_id
+                )
+
+
+def pipeline(crm, paths):
+    job_ids = create_jobs(crm, paths)
+    for job_id in job_ids:
+        crm.enqueue_import_job(job_id)
+    while True:
+        with crm.get_db() as conn:
+            pending = conn.execute(
+                "SELECT COUNT(*) FROM import_jobs WHERE state IN ('queued', 'running')"
+            ).fetchone()[0]
+        if not pending:
+            return
+        time.sleep(0.05)
+
+
+def run(crm, label, paths, tmp, fn):
+    crm.db_pool = crm.ConnectionPool(os.path.join(tmp, f"{label}.db"))
+    crm.init_db()
+    started = time.perf_counter()
+    fn(crm, paths)
+    elapsed = time.perf_counter() - started
+    with crm.get_db() as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+        failed = conn.execute(
+            "SELECT COUNT(*) FROM import_jobs WHERE state = 'failed'"
+        ).fetchone()[0]
+    crm.db_pool.close()
+    print(f"{label:<11} {elapsed:7.2f}s  {rows:>9,} rows  {rows / elapsed:10,.0f} rows/s  failed {failed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATA_DIR"] = tmp
+        os.environ["IMPORT_WORKERS"] = str(args.workers)
+        import app as crm
+
+        print(f"Building {args.files} files x {args.rows:,} rows (workers: {args.workers})...")
+        paths = build_files(tmp, args.files, args.rows)
+        run(crm, "sequential", paths, tmp, sequential)
+        run(crm, "pipeline", paths, tmp, pipeline)
+
+
+if __name__ == "__main__":
+    main()
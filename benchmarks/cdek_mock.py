@@ -0,0 +1,101 @@
+"""Local stand-in for the CDEK API used by the CDEK benchmarks.
+
+Serves ``POST /oauth/token`` and ``GET /orders?cdek_number=...`` with a
+configurable per-request latency, and counts the requests it receives.
+``forced_responses`` holds ``(status, headers)`` pairs returned by the next
+orders requests, e.g. ``(429, {"Retry-After": "1"})`` or ``(503, {})``.
+"""
+
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class CdekMockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.05, statuses=None):
+        super().__init__(("127.0.0.1", 0), CdekMockHandler)
+        self.latency = latency
+        self.statuses = statuses or {}
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self.forced_responses = []
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def order_payload(self, cdek_number):
+        statuses = self.statuses.get(cdek_number) or [
+            {
+                "code": "RECEIVED_AT_SHIPMENT_WAREHOUSE",
+                "name": "Принят на склад отправителя",
+                "date_time": "2024-01-01T10:00:00+0000",
+                "city": "Москва",
+            },
+            {
+                "code": "IN_TRANSIT",
+                "name": "В пути",
+                "date_time": "2024-01-02T10:00:00+0000",
+                "city": "Казань",
+            },
+        ]
+        return {"entity": {"cdek_number": cdek_number, "statuses": statuses}}
+
+
+class CdekMockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        return
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        with self.server.lock:
+            self.server.requests["token"] += 1
+        if urlparse(self.path).path.endswith("/oauth/token"):
+            self._send_json(200, {"access_token": "mock-token", "expires_in": 3600})
+        else:
+            self._send_json(404, {})
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        with self.server.lock:
+            self.server.requests["orders"] += 1
+            forced = self.server.forced_responses.pop(0) if self.server.forced_responses else None
+        time.sleep(self.server.latency)
+        if forced:
+            status, headers = forced
+            self._send_json(status, {}, headers)
+            return
+        if not parsed.path.endswith("/orders"):
+            self._send_json(404, {})
+            return
+        cdek_number = parse_qs(parsed.query).get("cdek_number", [""])[0]
+        self._send_json(200, self.server.order_payload(cdek_number))
+
+
+def configure_app(crm, server):
+    crm.CDEK_CLIENT_ID = "mock-client"
+    crm.CDEK_CLIENT_SECRET = "mock-secret"
+    crm.CDEK_TOKEN_URL = f"{server.base_url}/oauth/token"
+    crm.CDEK_ORDERS_URL = f"{server.base_url}/orders"
@@ -0,0 +1,97 @@
+"""CDEK sweep against a local mock: sequential per-shipment fetches vs. batched refresh.
+
+Usage:
+    python benchmarks/cdek_refresh_benchmark.py --shipments 500 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as crm  # noqa: E402
+from cdek_mock import CdekMockServer, configure_app  # noqa: E402
+
+
+def seed(count):
+    now = crm.datetime.utcnow().isoformat()
+    with crm.get_db() as conn:
+        conn.execute("DELETE FROM shipment_status_events")
+        conn.execute("DELETE FROM shipments")
+        conn.executemany(
+            """
+            INSERT INTO shipments
+            (origin_label, destination_label, internal_number, display_number,
+             cdek_number, created_at)
+            VALUES ('Склад', 'Точка', ?, ?, ?, ?)
+            """,
+            [(f"{idx:010d}",) * 3 + (now,) for idx in range(count)],
+        )
+        return conn.execute("SELECT * FROM shipments").fetchall()
+
+
+def legacy_sweep(shipments):
+    with crm.get_db() as conn:
+        for shipment in shipments:
+            status = asyncio.run(legacy_fetch(shipment["cdek_number"]))
+            crm.apply_cdek_status(conn, shipment, status)
+
+
+async def legacy_fetch(cdek_number):
+    async with crm.httpx.AsyncClient(timeout=30) as client:
+        token = (await client.post(crm.CDEK_TOKEN_URL)).json()["access_token"]
+        response = await client.get(
+            crm.CDEK_ORDERS_URL,
+            params={"cdek_number": cdek_number},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+    return crm._parse_cdek_order_payload(response.json())
+
+
+def run(label, sweep, count, server):
+    shipments = seed(count)
+    server.requests.clear()
+    started = time.perf_counter()
+    sweep(shipments)
+    elapsed = time.perf_counter() - started
+    with crm.get_db() as conn:
+        updated = conn.execute(
+            "SELECT COUNT(*) FROM shipments WHERE last_status IS NOT NULL"
+        ).fetchone()[0]
+    print(
+        f"{label:<10} {elapsed:7.2f}s  {count / elapsed:8.1f} shipments/s  "
+        f"updated {updated}/{count}  requests {dict(server.requests)}"
+    )
+    return updated == count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shipments", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--rate-limit", type=float, default=1000, help="client requests/s")
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+    server = CdekMockServer(latency=args.latency).start()
+    configure_app(crm, server)
+    crm.cdek_rate_limiter = crm.TokenBucket(args.rate_limit, max(int(args.rate_limit), 1))
+    with tempfile.TemporaryDirectory() as tmp:
+        crm.DATA_DIR = tmp
+        crm.db_pool = crm.ConnectionPool(os.path.join(tmp, "crm.db"))
+        crm.init_db()
+        ok = True
+        if not args.skip_legacy:
+            ok &= run("legacy", legacy_sweep, args.shipments, server)
+        ok &= run("batched", crm.refresh_cdek_shipments, args.shipments, server)
+        crm.db_pool.close()
+    server.shutdown()
+    if not ok:
+        raise SystemExit("Not every shipment was updated.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Replay recorded CDEK ORDER_STATUS webhooks against the receiver.
+
+Without --url the payloads are posted in-process to a fresh database with a seeded
+shipment; each one is sent twice and in reverse order to check dedup and ordering.
+
+Usage:
+    python benchmarks/cdek_webhook_replay.py
+    python benchmarks/cdek_webhook_replay.py --url https://crm.example.com --secret ...
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PAYLOADS = os.path.join(ROOT, "benchmarks", "data", "cdek_webhooks.json")
+
+
+def load_payloads(path):
+    with open(path, encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def replay_remote(url, secret, payloads):
+    endpoint = f"{url.rstrip('/')}/api/cdek/webhook"
+    with httpx.Client(timeout=10) as client:
+        for payload in payloads:
+            response = client.post(endpoint, params={"token": secret}, json=payload)
+            print(response.status_code, response.text.strip())
+
+
+def replay_local(secret, payloads):
+    os.environ["DATA_DIR"] = tempfile.mkdtemp()
+    os.environ["CDEK_WEBHOOK_SECRET"] = secret
+    sys.path.insert(0, ROOT)
+    import app as crm
+
+    crm.init_db()
+    numbers = sorted({payload["attributes"]["cdek_number"] for payload in payloads})
+    now = crm.datetime.utcnow().isoformat()
+    with crm.get_db() as conn:
+        conn.executemany(
+            """
+            INSERT INTO shipments
+            (origin_label, destination_label, internal_number, display_number,
+             cdek_number, next_poll_at, created_at)
+            VALUES ('Склад', 'Точка', ?, ?, ?, ?, ?)
+            """,
+            [(number, number, number, now, now) for number in numbers],
+        )
+    client = crm.app.test_client()
+    for payload in payloads + list(reversed(payloads)):
+        response = client.post("/api/cdek/webhook", query_string={"token": secret}, json=payload)
+        print(response.status_code, response.get_json())
+    with crm.get_db() as conn:
+        for row in conn.execute(
+            "SELECT cdek_number, cdek_state, last_update, next_poll_at FROM shipments"
+        ):
+            print(dict(row))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payloads", default=DEFAULT_PAYLOADS)
+    parser.add_argument("--url")
+    parser.add_argument("--secret", default=os.environ.get("CDEK_WEBHOOK_SECRET", "replay"))
+    args = parser.parse_args()
+    payloads = load_payloads(args.payloads)
+    if args.url:
+        replay_remote(args.url, args.secret, payloads)
+    else:
+        replay_local(args.secret, payloads)
+
+
+if __name__ == "__main__":
+    main()
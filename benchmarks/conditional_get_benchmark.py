@@ -0,0 +1,106 @@
+"""Polling tab: full responses on every poll vs. ETag revalidation (304 Not Modified).
+
+Usage:
+    python benchmarks/conditional_get_benchmark.py --rows 2000 --polls 200
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["DATA_DIR"] = tempfile.mkdtemp()
+
+import app as crm  # noqa: E402
+
+ENDPOINTS = [
+    "/api/tasks",
+    "/api/knowledge",
+    "/api/bloggers",
+    "/api/shipments",
+    "/api/locations",
+    "/api/training/overview",
+]
+
+
+def seed(rows):
+    now = crm.datetime.utcnow().isoformat()
+    with crm.get_db() as conn:
+        conn.executemany(
+            """
+            INSERT INTO tasks
+            (title, status, priority, assignee, deadline, created_by_name,
+             created_by_login, created_by_role, created_at, updated_at)
+            VALUES (?, 'В работе', 'Средний', 'Админ', NULL, 'Админ', 'admin', 'admin', ?, ?)
+            """,
+            [(f"Задача {idx}", now, now) for idx in range(rows)],
+        )
+        conn.executemany(
+            """
+            INSERT INTO knowledge_items
+            (title, section, owner, tag, created_by_name, created_by_login,
+             created_by_role, created_at, updated_at)
+            VALUES (?, 'Общее', 'Админ', 'WIKI', 'Админ', 'admin', 'admin', ?, ?)
+            """,
+            [(f"Документ {idx}", now, now) for idx in range(rows)],
+        )
+        conn.executemany(
+            "INSERT INTO bloggers (name, platform, profile_url, notes, created_at) VALUES (?, 'YouTube', '', '', ?)",
+            [(f"Блогер {idx}", now) for idx in range(rows)],
+        )
+        conn.executemany(
+            """
+            INSERT INTO shipments
+            (origin_label, destination_label, internal_number, display_number,
+             cdek_number, last_status, created_at)
+            VALUES ('Склад', 'Точка', ?, ?, ?, 'Принят', ?)
+            """,
+            [(f"{idx:010d}",) * 3 + (now,) for idx in range(rows)],
+        )
+        conn.executemany(
+            "INSERT INTO locations (name, address, created_at) VALUES (?, '', ?)",
+            [(f"Точка {idx}", now) for idx in range(rows // 10)],
+        )
+
+
+def poll(client, polls, conditional):
+    etags = {}
+    sent = 0
+    statuses = {}
+    started = time.process_time()
+    for _ in range(polls):
+        for path in ENDPOINTS:
+            headers = {"If-None-Match": etags[path]} if conditional and path in etags else {}
+            response = client.get(path, headers=headers)
+            if response.headers.get("ETag"):
+                etags[path] = response.headers["ETag"]
+            sent += len(response.data)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return time.process_time() - started, sent, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--polls", type=int, default=200)
+    args = parser.parse_args()
+
+    crm.init_db()
+    seed(args.rows)
+    client = crm.app.test_client()
+    client.post("/api/login", json={"login": crm.ADMIN_LOGIN, "password": crm.PASSWORD})
+
+    requests_total = args.polls * len(ENDPOINTS)
+    for label, conditional in [("full", False), ("etag", True)]:
+        elapsed, sent, statuses = poll(client, args.polls, conditional)
+        print(
+            f"{label:<6} {elapsed:8.2f}s cpu  {elapsed / requests_total * 1000:7.2f} ms/request"
+            f"  {sent / 1024 / 1024:9.2f} MiB sent  statuses {statuses}"
+        )
+
+
+if __name__ == "__main__":
+    main()
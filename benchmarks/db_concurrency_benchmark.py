@@ -0,0 +1,109 @@
+"""Mixed read/write request throughput: per-call connections vs. the WAL pool.
+
+Usage:
+    python benchmarks/db_concurrency_benchmark.py --threads 16 --seconds 10
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as crm  # noqa: E402
+
+
+def legacy_get_db_factory(path):
+    def get_db():
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    return get_db
+
+
+def seed(rows):
+    with crm.get_db() as conn:
+        conn.execute(
+            "INSERT INTO locations (name, address, created_at) VALUES ('Bench', '', '2024-01-01')"
+        )
+        for idx in range(rows):
+            conn.execute(
+                """
+                INSERT INTO tasks (title, status, priority, created_at, updated_at)
+                VALUES (?, 'open', 'low', '2024-01-01', '2024-01-01')
+                """,
+                (f"Task {idx}",),
+            )
+
+
+def worker(stop_at, write_every, counters, lock):
+    client = crm.app.test_client()
+    client.post("/api/login", json={"login": crm.ADMIN_LOGIN, "password": crm.PASSWORD})
+    done = errors = 0
+    while time.perf_counter() < stop_at:
+        if done % write_every == 0:
+            response = client.post(
+                "/api/tasks", json={"title": "bench", "status": "open", "priority": "low"}
+            )
+        elif done % 2:
+            response = client.get("/api/tasks")
+        else:
+            response = client.get("/api/locations")
+        done += 1
+        errors += response.status_code >= 500
+    with lock:
+        counters["requests"] += done
+        counters["errors"] += errors
+
+
+def run(label, threads, seconds, write_every):
+    counters = {"requests": 0, "errors": 0}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + seconds
+    pool = [
+        threading.Thread(target=worker, args=(stop_at, write_every, counters, lock))
+        for _ in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    print(
+        f"{label:<8} {counters['requests'] / seconds:10,.0f} req/s  "
+        f"errors {counters['errors']}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--rows", type=int, default=200, help="tasks seeded before the run")
+    parser.add_argument("--write-every", type=int, default=5, help="one write per N requests")
+    args = parser.parse_args()
+    crm.app.logger.disabled = True
+    with tempfile.TemporaryDirectory() as tmp:
+        original_get_db = crm.get_db
+        for label in ["legacy", "pooled"]:
+            path = os.path.join(tmp, f"{label}.db")
+            crm.DATA_DIR = tmp
+            crm.get_db = original_get_db
+            crm.db_pool = crm.ConnectionPool(path)
+            crm.init_db()
+            seed(args.rows)
+            crm.db_pool.close()
+            if label == "legacy":
+                with sqlite3.connect(path) as conn:
+                    conn.execute("PRAGMA journal_mode = DELETE")
+                crm.get_db = legacy_get_db_factory(path)
+            run(label, args.threads, args.seconds, args.write_every)
+            crm.db_pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Export benchmark: pandas ExcelWriter, streaming xlsx, gzip CSV and Parquet.
+
+Each export runs in a fresh process so peak RSS is measured per path. Parquet
+is skipped when pyarrow is not installed.
+
+Usage:
+    python benchmarks/export_benchmark.py --rows 300000 --locations 5
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as crm  # noqa: E402
+
+
+def seed(path, rows, locations):
+    crm.db_pool = crm.ConnectionPool(path)
+    crm.init_db()
+    rng = np.random.default_rng(7)
+    per_location = rows // locations
+    with crm.get_db() as conn:
+        for index in range(locations):
+            location_id = conn.execute(
+                "INSERT INTO locations (name, created_at) VALUES (?, ?)",
+                (f"Точка {index + 1}", "2024-01-01T00:00:00"),
+            ).lastrowid
+            frame = pd.DataFrame(
+                {
+                    "product": [f"Товар {idx % 5000}" for idx in range(per_location)],
+                    "stock": rng.integers(0, 500, per_location),
+                    "sales_qty": rng.integers(0, 50, per_location),
+                    "sales_amount": rng.random(per_location) * 10000,
+                    "record_date": "2024-01-31",
+                }
+            )
+            crm.insert_records(conn, location_id, frame, "bench.xlsx")
+    crm.db_pool.close()
+
+
+def legacy_export(conn, path):
+    locations = conn.execute("SELECT id, name FROM locations ORDER BY name").fetchall()
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        for location in locations:
+            records = conn.execute(crm.EXPORT_RECORDS_SQL, (location["id"],)).fetchall()
+            frame = pd.DataFrame([tuple(row) for row in records], columns=crm.EXPORT_COLUMNS)
+            frame.to_excel(writer, index=False, sheet_name=location["name"][:31])
+
+
+def streaming_export(conn, path):
+    locations = conn.execute("SELECT id, name FROM locations ORDER BY name").fetchall()
+    crm.write_records_workbook(conn, locations, path)
+
+
+def csv_export(conn, path):
+    with open(path, "wb") as handle:
+        for chunk in crm.iter_csv_gzip(conn, crm.EXPORT_ALL_RECORDS_SQL, ()):
+            handle.write(chunk)
+
+
+def parquet_export(conn, path):
+    crm.write_all_locations_parquet(conn, path)
+
+
+EXPORTS = {
+    "legacy": (legacy_export, ".xlsx"),
+    "streaming": (streaming_export, ".xlsx"),
+    "csv": (csv_export, ".csv.gz"),
+    "parquet": (parquet_export, ".parquet.zip"),
+}
+
+
+def child(mode, db_path):
+    crm.db_pool = crm.ConnectionPool(db_path)
+    os.makedirs(crm.EXPORT_DIR, exist_ok=True)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    export, suffix = EXPORTS[mode]
+    path = os.path.join(os.path.dirname(db_path), f"{mode}{suffix}")
+    started = time.perf_counter()
+    with crm.get_db() as conn:
+        export(conn, path)
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    size = os.path.getsize(path)
+    print(
+        f"{mode:<10} {elapsed:7.2f}s  peak RSS +{(peak - baseline) / 1024:7.1f} MiB  "
+        f"file {size / 1024 / 1024:6.1f} MiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=300_000)
+    parser.add_argument("--locations", type=int, default=5)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "DB"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        print(f"Seeding {args.rows:,} records across {args.locations} locations...")
+        seed(db_path, args.rows, args.locations)
+        for mode in EXPORTS:
+            if mode == "parquet" and crm.pq is None:
+                print("parquet    skipped: pyarrow is not installed")
+                continue
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", mode, db_path],
+                check=True,
+                env={**os.environ, "DATA_DIR": tmp},
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Import pipeline benchmark: legacy row-wise path vs. vectorized path.
+
+Usage:
+    python benchmarks/import_benchmark.py --rows 200000 --format xlsx
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as crm  # noqa: E402
+
+def build_workbook(path, rows):
+    rng = np.random.default_rng(42)
+    stock = rng.integers(0, 500, rows).astype(object)
+    stock[::17] = "0 (продались)"
+    frame = pd.DataFrame(
+        {
+            "Бренд": rng.choice(["Nike", "Adidas", "Puma", "Reebok"], rows),
+            "Номенклатура": [f"Товар {idx % 5000}" for idx in range(rows)],
+            "Характеристика": rng.choice(["S", "M", "L", "XL", None], rows),
+            "Отгруз факт": stock,
+            "Отгруз по списку": rng.integers(0, 50, rows),
+            "Сумма": rng.random(rows) * 10000,
+            "Дата": "2024-01-31",
+        }
+    )
+    if path.endswith(".csv"):
+        frame.to_csv(path, index=False)
+    else:
+        frame.to_excel(path, index=False)
+
+
+def legacy_coerce_number(value):
+    if pd.isna(value):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r"-?\d+[\.,]?\d*", str(value))
+    if not match:
+        return None
+    return float(match.group(0).replace(",", "."))
+
+
+def legacy_normalize(data, mapping):
+    parsed = data.rename(columns={column: key for key, column in mapping.items()})
+    parsed["product"] = parsed.apply(
+        lambda row: " ".join(
+            str(value).strip()
+            for value in [row.get("brand"), row.get("product"), row.get("characteristic")]
+            if pd.notna(value) and str(value).strip()
+        ),
+        axis=1,
+    )
+    for key in ["stock", "sales_qty", "sales_amount"]:
+        parsed[key] = parsed[key].apply(legacy_coerce_number)
+    return parsed[crm.RECORD_COLUMNS]
+
+
+def legacy_insert(conn, data, source_file):
+    with conn:
+        for _, row in data.iterrows():
+            product = str(row["product"])
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO products (product_key, display_name, created_at)
+                VALUES (?, ?, ?)
+                """,
+                (crm.normalize_product_key(product), product, datetime.utcnow().isoformat()),
+            )
+            product_id = conn.execute(
+                "SELECT id FROM products WHERE product_key = ?",
+                (crm.normalize_product_key(product),),
+            ).fetchone()[0]
+            conn.execute(
+                """
+                INSERT INTO records
+                (location_id, product_id, stock, sales_qty, sales_amount, record_date, source_file, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    1,
+                    product_id,
+                    int(row["stock"]) if pd.notna(row["stock"]) else None,
+                    int(row["sales_qty"]) if pd.notna(row["sales_qty"]) else None,
+                    float(row["sales_amount"]) if pd.notna(row["sales_amount"]) else None,
+                    str(row["record_date"]) if pd.notna(row["record_date"]) else None,
+                    source_file,
+                    datetime.utcnow().isoformat(),
+                ),
+            )
+
+
+def vectorized_insert(conn, data, source_file):
+    with conn:
+        crm.insert_records(conn, 1, data, source_file)
+
+
+def run(label, data, mapping, normalize, insert):
+    with tempfile.TemporaryDirectory() as tmp:
+        crm.db_pool = crm.ConnectionPool(os.path.join(tmp, "bench.db"))
+        crm.init_db()
+        with crm.get_db() as conn:
+            started = time.perf_counter()
+            parsed = normalize(data.copy(), mapping)
+            parsed_at = time.perf_counter()
+            insert(conn, parsed, "bench")
+            finished = time.perf_counter()
+            rows = conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+        crm.db_pool.close()
+    total = finished - started
+    print(
+        f"{label:<11} normalize {parsed_at - started:7.2f}s  "
+        f"insert {finished - parsed_at:7.2f}s  "
+        f"total {total:7.2f}s  {rows / total:12,.0f} rows/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--format", choices=["xlsx", "csv"], default="xlsx")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"bench.{args.format}")
+        print(f"Building {args.rows:,} row {args.format} workbook...")
+        build_workbook(path, args.rows)
+        started = time.perf_counter()
+        data = pd.read_csv(path) if args.format == "csv" else pd.read_excel(path)
+        print(f"Read file in {time.perf_counter() - started:.2f}s (shared by both paths)")
+    mapping = crm.infer_columns(list(data.columns))
+    run("legacy", data, mapping, legacy_normalize, legacy_insert)
+    run("vectorized", data, mapping, crm.normalize_frame, vectorized_insert)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,9 @@ const state = {
   shipments: [],
   currentLocationId: null,
   currentShipmentId: null,
+  recordsLocationId: null,
+  recordsCursor: null,
+  recordsRequestId: 0,
 };
 
 const modal = (id) => document.getElementById(id);
@@ -364,6 +367,32 @@ async function refreshShipment(shipmentId) {
   }
 }
 
+async function refreshAllShipments() {
+  const button = qs("shipments-refresh-all");
+  button.disabled = true;
+  try {
+    const data = await api("/api/shipments/refresh", {
+      method: "POST",
+      body: JSON.stringify({ stale: true }),
+    });
+    const refreshed = new Map(data.shipments.map((item) => [item.id, item]));
+    state.shipments = state.shipments.map((item) => refreshed.get(item.id) || item);
+    renderShipments();
+    const current = refreshed.get(state.currentShipmentId);
+    if (current) {
+      renderShipmentDetails(current, data.history[current.id] || []);
+    }
+    showNotification(
+      `Статусы обновлены: ${data.updated} из ${data.shipments.length}.`,
+      "success",
+    );
+  } catch (err) {
+    showNotification(err.message, "error");
+  } finally {
+    button.disabled = false;
+  }
+}
+
 async function handleAddLocation() {
   const name = qs("location-name").value.trim();
   const address = qs("location-address").value.trim();
@@ -444,10 +473,33 @@ async function openUpload(locationId) {
   const location = state.locations.find((item) => item.id === locationId);
   qs("upload-location").textContent = `Точка: ${location?.name || ""}`;
   qs("upload-error").textContent = "";
+  qs("upload-progress").textContent = "";
   qs("upload-file").value = "";
   openModal("upload-modal");
 }
 
+const importPollIntervalMs = 1500;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+async function watchImportJob(jobId, progress) {
+  while (true) {
+    await sleep(importPollIntervalMs);
+    const job = await api(`/api/imports/${jobId}`);
+    if (job.state === "done" || job.state === "skipped") return job;
+    if (job.state === "failed" || job.state === "cancelled") {
+      throw new Error(job.error || "Ошибка импорта");
+    }
+    if (job.state === "running") {
+      progress.textContent = `Импортировано строк: ${formatNumber(
+        job.rows,
+      )} (${Math.round((job.progress || 0) * 100)}%)`;
+    } else {
+      progress.textContent = "Файл в очереди на импорт...";
+    }
+  }
+}
+
 async function submitUpload() {
   const fileInput = qs("upload-file");
   const error = qs("upload-error");
@@ -459,52 +511,112 @@ async function submitUpload() {
   const formData = new FormData();
   formData.append("location_id", state.currentLocationId);
   formData.append("file", fileInput.files[0]);
+  const progress = qs("upload-progress");
+  progress.textContent = "Загрузка файла...";
   try {
     const response = await fetch("/api/upload", { method: "POST", body: formData });
     if (!response.ok) {
       const data = await response.json().catch(() => ({}));
       throw new Error(data.error || "Ошибка загрузки");
     }
+    const { job_id: jobId, duplicate } = await response.json();
+    if (duplicate) {
+      closeModal("upload-modal");
+      showNotification("Файл уже загружен ранее, данные не изменились.", "info");
+      return;
+    }
+    showNotification("Файл загружен, импорт выполняется в фоне.", "info");
+    const job = await watchImportJob(jobId, progress);
     closeModal("upload-modal");
     await loadLocations();
-    showNotification("Файл успешно импортирован.", "success");
+    const skipped = job.skipped_rows
+      ? ` Без изменений пропущено: ${formatNumber(job.skipped_rows)}.`
+      : "";
+    showNotification(
+      `Файл успешно импортирован. Строк: ${formatNumber(job.rows)}.${skipped}`,
+      "success",
+    );
   } catch (err) {
     error.textContent = err.message;
     showNotification(err.message, "error");
+  } finally {
+    progress.textContent = "";
   }
 }
 
-async function openRecords(locationId) {
-  const location = state.locations.find((item) => item.id === locationId);
-  qs("records-title").textContent = location?.name || "Детали точки";
-  qs("records-export").dataset.exportLocation = locationId;
-  qs("records-delete").dataset.deleteLocation = locationId;
+function recordsQuery(cursor) {
+  const [sort, order] = qs("records-sort").value.split(":");
+  const params = new URLSearchParams({ sort, order });
+  const filters = {
+    product: qs("records-product").value.trim(),
+    source_file: qs("records-source").value.trim(),
+    date_from: qs("records-date-from").value,
+    date_to: qs("records-date-to").value,
+  };
+  Object.entries(filters).forEach(([key, value]) => {
+    if (value) params.set(key, value);
+  });
+  if (cursor) params.set("cursor", cursor);
+  return params.toString();
+}
+
+async function loadRecordsPage({ append = false } = {}) {
+  const locationId = state.recordsLocationId;
   const body = qs("records-body");
-  body.innerHTML = "";
+  const more = qs("records-more");
+  const requestId = (state.recordsRequestId || 0) + 1;
+  state.recordsRequestId = requestId;
+  if (!append) {
+    state.recordsCursor = null;
+  }
+  more.disabled = true;
   try {
-    const records = await api(`/api/records/${locationId}`);
-    if (!records.length) {
+    const page = await api(`/api/records/${locationId}?${recordsQuery(state.recordsCursor)}`);
+    if (requestId !== state.recordsRequestId) return;
+    if (!append) {
+      body.innerHTML = "";
+    }
+    if (!append && !page.items.length) {
       body.innerHTML = "<tr><td colspan='6'>Нет данных</td></tr>";
-    } else {
-      records.forEach((record) => {
-        const row = document.createElement("tr");
-        row.innerHTML = `
-          <td>${record.product}</td>
-          <td>${formatNumber(record.stock)}</td>
-          <td>${formatNumber(record.sales_qty)}</td>
-          <td>${formatNumber(record.sales_amount)}</td>
-          <td>${record.record_date || "-"}</td>
-          <td>${record.source_file || "-"}</td>
-        `;
-        body.appendChild(row);
-      });
     }
-    openModal("records-modal");
+    page.items.forEach((record) => {
+      const row = document.createElement("tr");
+      row.innerHTML = `
+        <td>${record.product}</td>
+        <td>${formatNumber(record.stock)}</td>
+        <td>${formatNumber(record.sales_qty)}</td>
+        <td>${formatNumber(record.sales_amount)}</td>
+        <td>${record.record_date || "-"}</td>
+        <td>${record.source_file || "-"}</td>
+      `;
+      body.appendChild(row);
+    });
+    state.recordsCursor = page.next_cursor;
+    more.classList.toggle("hidden", !page.next_cursor);
   } catch (err) {
     body.innerHTML = `<tr><td colspan='6'>${err.message}</td></tr>`;
+  } finally {
+    more.disabled = false;
   }
 }
 
+async function openRecords(locationId) {
+  const location = state.locations.find((item) => item.id === locationId);
+  qs("records-title").textContent = location?.name || "Детали точки";
+  qs("records-export").dataset.exportLocation = locationId;
+  qs("records-delete").dataset.deleteLocation = locationId;
+  qs("records-body").innerHTML = "";
+  ["records-product", "records-source", "records-date-from", "records-date-to"].forEach(
+    (id) => {
+      qs(id).value = "";
+    },
+  );
+  qs("records-sort").value = "created_at:desc";
+  state.recordsLocationId = locationId;
+  openModal("records-modal");
+  await loadRecordsPage();
+}
+
 const sanitizeFilename = (value) =>
   value
     .replace(/[\\/:*?"<>|]+/g, "_")
@@ -559,6 +671,13 @@ function registerEvents() {
     qs("shipment-save").addEventListener("click", handleAddShipment);
     qs("upload-submit").addEventListener("click", submitUpload);
   }
+  qs("shipments-refresh-all")?.addEventListener("click", refreshAllShipments);
+  let recordsFilterTimer = null;
+  qs("records-filters").addEventListener("input", () => {
+    clearTimeout(recordsFilterTimer);
+    recordsFilterTimer = setTimeout(() => loadRecordsPage(), 300);
+  });
+  qs("records-more").addEventListener("click", () => loadRecordsPage({ append: true }));
   qs("logout-btn")?.addEventListener("click", async () => {
     await api("/api/logout", { method: "POST" });
     window.location.href = "/login";
@@ -615,6 +734,31 @@ function registerEvents() {
   });
 }
 
+function applyShipmentChange(change) {
+  if (change.action === "deleted") {
+    state.shipments = state.shipments.filter((item) => item.id !== change.id);
+  } else if (state.shipments.some((item) => item.id === change.id)) {
+    state.shipments = state.shipments.map((item) =>
+      item.id === change.id ? change.data : item,
+    );
+  } else {
+    state.shipments = [change.data, ...state.shipments];
+  }
+  renderShipments();
+}
+
+function subscribeToShipments() {
+  if (!window.EventSource) return;
+  const source = new EventSource("/api/events?channels=shipments");
+  source.addEventListener("shipments", (event) => {
+    applyShipmentChange(JSON.parse(event.data));
+  });
+  source.addEventListener("reset", () => {
+    loadShipments().catch(() => {});
+  });
+  window.addEventListener("beforeunload", () => source.close());
+}
+
 async function init() {
   registerEvents();
   const isAuthed = document.body?.dataset?.authed === "true";
@@ -625,6 +769,7 @@ async function init() {
   try {
     await loadLocations();
     await loadShipments();
+    subscribeToShipments();
   } catch (err) {
     if (err.message !== "unauthorized") {
       console.error(err);
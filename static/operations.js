@@ -23,6 +23,18 @@ const setDefaultDeadline = () => {
 
 const POLL_INTERVAL_MS = 15000;
 let pollHandle = null;
+let changeSource = null;
+let taskItems = [];
+let knowledgeItems = [];
+let taskCursor = 0;
+let knowledgeCursor = 0;
+
+function mergeDelta(items, delta) {
+  const replaced = new Set([...delta.deleted, ...delta.items.map((item) => item.id)]);
+  return [...delta.items, ...items.filter((item) => !replaced.has(item.id))].sort((a, b) =>
+    (b.updated_at || "").localeCompare(a.updated_at || ""),
+  );
+}
 
 async function api(path, options = {}) {
   const response = await fetch(path, {
@@ -148,7 +160,10 @@ async function refreshTasks({ silent = false } = {}) {
     if (!silent) {
       setSyncStatus("task-sync-status", "Синхронизация...", "syncing");
     }
-    const tasks = await api("/api/tasks");
+    const delta = await api(`/api/tasks?since=${taskCursor}`);
+    taskItems = mergeDelta(taskItems, delta);
+    taskCursor = delta.cursor;
+    const tasks = taskItems;
     renderTasks(tasks);
     renderStats(tasks);
     setSyncStatus(
@@ -168,7 +183,10 @@ async function refreshKnowledge({ silent = false } = {}) {
     if (!silent) {
       setSyncStatus("knowledge-sync-status", "Синхронизация...", "syncing");
     }
-    const items = await api("/api/knowledge");
+    const delta = await api(`/api/knowledge?since=${knowledgeCursor}`);
+    knowledgeItems = mergeDelta(knowledgeItems, delta);
+    knowledgeCursor = delta.cursor;
+    const items = knowledgeItems;
     renderKnowledge(items);
     setSyncStatus(
       "knowledge-sync-status",
@@ -203,6 +221,48 @@ function stopPolling() {
   pollHandle = null;
 }
 
+function applyChange(items, change) {
+  const rest = items.filter((item) => item.id !== change.id);
+  return change.action === "deleted" ? rest : [change.data, ...rest];
+}
+
+function subscribeToChanges() {
+  const channels = [];
+  if (qs("task-table-body") || qs("load-stats")) channels.push("tasks");
+  if (qs("knowledge-table-body")) channels.push("knowledge");
+  if (!channels.length) return;
+  if (!window.EventSource) {
+    startPolling();
+    window.addEventListener("beforeunload", stopPolling);
+    return;
+  }
+  changeSource = new EventSource(`/api/events?channels=${channels.join(",")}`);
+  changeSource.addEventListener("tasks", (event) => {
+    taskItems = applyChange(taskItems, JSON.parse(event.data));
+    renderTasks(taskItems);
+    renderStats(taskItems);
+    setSyncStatus(
+      "task-sync-status",
+      `Обновлено ${formatTimestamp(new Date().toISOString())}`,
+      "ready",
+    );
+  });
+  changeSource.addEventListener("knowledge", (event) => {
+    knowledgeItems = applyChange(knowledgeItems, JSON.parse(event.data));
+    renderKnowledge(knowledgeItems);
+    setSyncStatus(
+      "knowledge-sync-status",
+      `Обновлено ${formatTimestamp(new Date().toISOString())}`,
+      "ready",
+    );
+  });
+  changeSource.addEventListener("reset", () => {
+    if (channels.includes("tasks")) refreshTasks({ silent: true });
+    if (channels.includes("knowledge")) refreshKnowledge({ silent: true });
+  });
+  window.addEventListener("beforeunload", () => changeSource.close());
+}
+
 function initTasksPage() {
   setDefaultDeadline();
   refreshTasks();
@@ -290,10 +350,7 @@ function init() {
 
   initOperationsHome();
 
-  if (qs("task-table-body") || qs("knowledge-table-body") || qs("load-stats")) {
-    startPolling();
-    window.addEventListener("beforeunload", stopPolling);
-  }
+  subscribeToChanges();
 }
 
 init();
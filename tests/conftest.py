@@ -0,0 +1,80 @@
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="crm-tests-")
+os.environ.setdefault("IMPORT_WORKERS", "2")
+# Parsing runs in spawned workers, so the chunk size has to come from the
+# environment; small chunks push every test file through the multi-chunk path.
+os.environ.setdefault("IMPORT_CHUNK_SIZE", "2")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as crm  # noqa: E402
+
+FINISHED_IMPORT_STATES = {"done", "failed", "skipped", "cancelled"}
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    pool = crm.ConnectionPool(str(tmp_path / "crm.db"))
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    monkeypatch.setattr(crm, "db_pool", pool)
+    monkeypatch.setattr(crm, "import_jobs_resumed", True)
+    monkeypatch.setitem(crm.app.config, "UPLOAD_DIR", str(upload_dir))
+    crm.init_db()
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def client(db):
+    client = crm.app.test_client()
+    response = client.post(
+        "/api/login", json={"login": crm.ADMIN_LOGIN, "password": crm.PASSWORD}
+    )
+    assert response.status_code == 200
+    return client
+
+
+@pytest.fixture
+def add_location(client):
+    def add(name):
+        assert client.post("/api/locations", json={"name": name}).status_code == 200
+        with crm.get_db() as conn:
+            return conn.execute(
+                "SELECT id FROM locations WHERE name = ? ORDER BY id DESC", (name,)
+            ).fetchone()["id"]
+
+    return add
+
+
+@pytest.fixture
+def upload(client):
+    def send(location_id, content, filename="report.csv"):
+        response = client.post(
+            "/api/upload",
+            data={"location_id": str(location_id), "file": (content, filename)},
+        )
+        return response.status_code, response.get_json()
+
+    return send
+
+
+def wait_for_job(job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with crm.get_db() as conn:
+            job = conn.execute("SELECT * FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+        if job["state"] in FINISHED_IMPORT_STATES:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"import job {job_id} did not finish in {timeout}s")
+
+
+@pytest.fixture
+def finished_job():
+    return wait_for_job
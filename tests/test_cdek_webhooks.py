@@ -0,0 +1,138 @@
+import logging
+import time
+
+import pytest
+
+from conftest import crm
+
+SECRET = "test-secret"
+CDEK_NUMBER = "1000000001"
+
+
+@pytest.fixture
+def shipment_id(client, monkeypatch):
+    monkeypatch.setattr(crm, "CDEK_WEBHOOK_SECRET", SECRET)
+    response = client.post(
+        "/api/shipments",
+        json={
+            "origin_label": "Склад",
+            "destination_label": "Магазин",
+            "display_number": CDEK_NUMBER,
+        },
+    )
+    assert response.status_code == 200
+    with crm.get_db() as conn:
+        return conn.execute(
+            "SELECT id FROM shipments WHERE cdek_number = ?", (CDEK_NUMBER,)
+        ).fetchone()["id"]
+
+
+def webhook(code, timestamp, uuid=None):
+    return {
+        "type": "ORDER_STATUS",
+        "date_time": timestamp,
+        "uuid": uuid or f"{code}-{timestamp}",
+        "attributes": {
+            "cdek_number": CDEK_NUMBER,
+            "code": code,
+            "status_date_time": timestamp,
+            "city_name": "Москва",
+        },
+    }
+
+
+def deliver(client, payload, token=SECRET):
+    response = client.post(f"/api/cdek/webhook?token={token}", json=payload)
+    return response.status_code, response.get_json()
+
+
+def shipment_state(shipment_id):
+    with crm.get_db() as conn:
+        row = conn.execute(
+            "SELECT cdek_state, last_update FROM shipments WHERE id = ?", (shipment_id,)
+        ).fetchone()
+    return row["cdek_state"], row["last_update"]
+
+
+def history_codes(shipment_id):
+    with crm.get_db() as conn:
+        return [
+            row["status_code"]
+            for row in conn.execute(
+                """
+                SELECT status_code FROM shipment_status_history
+                WHERE shipment_id = ? ORDER BY timestamp
+                """,
+                (shipment_id,),
+            )
+        ]
+
+
+def test_webhook_requires_token(client, shipment_id):
+    payload = webhook("ACCEPTED", "2024-03-01T09:15:00+0300")
+    assert deliver(client, payload, token="wrong")[0] == 403
+    response = client.post(
+        "/api/cdek/webhook", json=payload, headers={"X-Webhook-Token": SECRET}
+    )
+    assert response.status_code == 200
+    assert shipment_state(shipment_id)[0] == "ACCEPTED"
+
+
+def test_duplicate_delivery_is_ignored(client, shipment_id):
+    payload = webhook("ACCEPTED", "2024-03-01T09:15:00+0300")
+    assert deliver(client, payload) == (200, {"ok": True, "duplicate": False, "updated": 1})
+    assert deliver(client, payload) == (200, {"ok": True, "duplicate": True, "updated": 0})
+    assert history_codes(shipment_id) == ["ACCEPTED"]
+
+
+def test_older_event_does_not_overwrite_newer_state(client, shipment_id):
+    deliver(client, webhook("DELIVERED", "2024-03-04T12:00:00+0300"))
+    status, body = deliver(client, webhook("ACCEPTED", "2024-03-01T09:15:00+0300"))
+
+    assert status == 200
+    assert body["updated"] == 0
+    assert shipment_state(shipment_id) == ("DELIVERED", "2024-03-04T12:00:00+0300")
+    assert history_codes(shipment_id) == ["ACCEPTED", "DELIVERED"]
+
+
+def test_ordering_compares_naive_poll_times_as_utc(client, shipment_id):
+    with crm.get_db() as conn:
+        conn.execute(
+            "UPDATE shipments SET cdek_state = 'ACCEPTED', last_update = ? WHERE id = ?",
+            ("2024-03-04T09:05:00", shipment_id),
+        )
+    assert deliver(client, webhook("DELIVERED", "2024-03-04T12:00:00+0300"))[1]["updated"] == 0
+    assert shipment_state(shipment_id)[0] == "ACCEPTED"
+    assert deliver(client, webhook("DELIVERED", "2024-03-04T12:10:00+0300"))[1]["updated"] == 1
+    assert shipment_state(shipment_id)[0] == "DELIVERED"
+
+
+def test_circuit_breaker_lets_one_probe_through():
+    breaker = crm.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    assert breaker.allow() == (True, False)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow() == (False, False)
+
+    breaker.opened_at = time.monotonic() - 61
+    assert breaker.allow() == (True, True)
+    assert breaker.allow() == (False, False)
+    breaker.record_success()
+    breaker.release_probe()
+    assert breaker.allow() == (True, False)
+    assert not breaker.probe_in_flight
+
+
+def test_access_log_redacts_webhook_token():
+    record = logging.LogRecord(
+        "werkzeug",
+        logging.INFO,
+        __file__,
+        0,
+        '"%s /api/cdek/webhook?token=%s HTTP/1.1" 200 -',
+        ("POST", SECRET),
+        None,
+    )
+    assert crm.RedactWebhookTokenFilter().filter(record)
+    assert SECRET not in record.getMessage()
+    assert "token=***" in record.getMessage()
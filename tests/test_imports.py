@@ -0,0 +1,190 @@
+import io
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from conftest import crm, wait_for_job
+
+COLUMNS = ["товар", "остаток", "продажи", "сумма", "дата"]
+
+
+def csv_bytes(rows):
+    return io.BytesIO(pd.DataFrame(rows, columns=COLUMNS).to_csv(index=False).encode())
+
+
+def location_records(location_id):
+    with crm.get_db() as conn:
+        return sorted(
+            tuple(row)
+            for row in conn.execute(
+                """
+                SELECT p.display_name, r.record_date, r.stock, r.sales_qty, r.sales_amount
+                FROM records r JOIN products p ON p.id = r.product_id
+                WHERE r.location_id = ?
+                """,
+                (location_id,),
+            )
+        )
+
+
+def location_row_counts(location_id):
+    with crm.get_db() as conn:
+        return {
+            table: conn.execute(
+                f"SELECT COUNT(*) FROM {table} WHERE location_id = ?", (location_id,)
+            ).fetchone()[0]
+            for table in [
+                "records",
+                "location_totals",
+                "current_stock",
+                "sales_rollups",
+                "import_batches",
+            ]
+        }
+
+
+def assert_totals_consistent():
+    with crm.get_db() as conn:
+        assert crm.diff_location_totals(conn) == []
+
+
+FIRST = [
+    ["x", 1, 1, 10, "2024-01-01"],
+    ["y", 2, 2, 20, "2024-01-01"],
+    ["z", 3, 3, 30, "2024-01-01"],
+]
+
+
+def test_exact_reupload_is_skipped(add_location, upload):
+    location_id = add_location("A")
+    status, body = upload(location_id, csv_bytes(FIRST))
+    assert status == 202
+    assert wait_for_job(body["job_id"])["state"] == "done"
+    before = location_records(location_id)
+
+    status, body = upload(location_id, csv_bytes(FIRST))
+    assert status == 200
+    assert body["duplicate"] is True
+    assert wait_for_job(body["job_id"])["state"] == "skipped"
+    assert location_records(location_id) == before
+    assert len(before) == 3
+    assert_totals_consistent()
+
+
+def test_overlapping_upload_writes_only_the_difference(add_location, upload):
+    location_id = add_location("A")
+    _, body = upload(location_id, csv_bytes(FIRST))
+    wait_for_job(body["job_id"])
+
+    second = [
+        ["x", 1, 1, 10, "2024-01-01"],
+        ["y", 5, 5, 50, "2024-01-01"],
+        ["w", 4, 4, 40, "2024-01-02"],
+    ]
+    _, body = upload(location_id, csv_bytes(second), "second.csv")
+    job = wait_for_job(body["job_id"])
+    assert job["state"] == "done"
+    assert job["skipped_rows"] == 1
+
+    records = location_records(location_id)
+    assert [row[:4] for row in records] == [
+        ("w", "2024-01-02", 4, 4),
+        ("x", "2024-01-01", 1, 1),
+        ("y", "2024-01-01", 5, 5),
+        ("z", "2024-01-01", 3, 3),
+    ]
+    assert_totals_consistent()
+
+
+def test_failed_chunk_leaves_no_rows(add_location, upload, monkeypatch):
+    location_id = add_location("A")
+    original = crm.write_import_chunk
+    calls = []
+
+    def failing_write(conn, job, data, *args):
+        calls.append(len(data))
+        if len(calls) == 2:
+            raise RuntimeError("disk full")
+        return original(conn, job, data, *args)
+
+    monkeypatch.setattr(crm, "write_import_chunk", failing_write)
+    rows = [[f"item {idx}", idx, 1, 10, "2024-01-01"] for idx in range(7)]
+    _, body = upload(location_id, csv_bytes(rows))
+
+    job = wait_for_job(body["job_id"])
+    assert job["state"] == "failed"
+    assert len(calls) >= 2
+    counts = location_row_counts(location_id)
+    del counts["location_totals"]
+    assert set(counts.values()) == {0}
+    with crm.get_db() as conn:
+        totals = conn.execute(
+            "SELECT total_sales_qty, total_sales_amount, record_count FROM location_totals"
+            " WHERE location_id = ?",
+            (location_id,),
+        ).fetchone()
+    assert totals is None or tuple(totals) == (0, 0, 0)
+    assert_totals_consistent()
+
+
+def test_upload_to_unknown_location_is_rejected(client, upload):
+    status, body = upload(999, csv_bytes(FIRST))
+    assert status == 404
+    assert "error" in body
+    assert list(crm.os.scandir(crm.app.config["UPLOAD_DIR"])) == []
+
+
+def test_deleting_location_cancels_its_imports(client, add_location, upload, monkeypatch):
+    location_id = add_location("A")
+    release = threading.Event()
+    original = crm.write_import_chunk
+
+    def blocked_write(*args):
+        release.wait(30)
+        return original(*args)
+
+    monkeypatch.setattr(crm, "write_import_chunk", blocked_write)
+    _, running = upload(location_id, csv_bytes(FIRST))
+    _, queued = upload(location_id, csv_bytes(FIRST[:1]), "other.csv")
+
+    assert client.delete(f"/api/locations/{location_id}").status_code == 200
+    release.set()
+
+    assert wait_for_job(running["job_id"])["state"] == "cancelled"
+    assert wait_for_job(queued["job_id"])["state"] == "cancelled"
+    assert set(location_row_counts(location_id).values()) == {0}
+    with crm.get_db() as conn:
+        event = conn.execute(
+            "SELECT channel, action, entity_id FROM change_events ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+    assert tuple(event) == ("locations", "deleted", location_id)
+
+
+def test_concurrent_identical_uploads_import_once(add_location, tmp_path):
+    location_id = add_location("A")
+    created_at = datetime.utcnow().isoformat()
+    barrier = threading.Barrier(3)
+    results = []
+
+    def create(index):
+        path = tmp_path / f"upload-{index}.csv"
+        path.write_bytes(b"payload")
+        barrier.wait()
+        with crm.app.test_request_context(), crm.get_db() as conn:
+            results.append(
+                crm.create_import_job(
+                    conn, location_id, "report.csv", str(path), "same-digest", created_at
+                )
+            )
+
+    threads = [threading.Thread(target=create, args=(index,)) for index in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(duplicate for _, duplicate in results) == [False, True, True]
+    with crm.get_db() as conn:
+        states = [row["state"] for row in conn.execute("SELECT state FROM import_jobs")]
+    assert sorted(states) == ["queued", "skipped", "skipped"]
@@ -0,0 +1,179 @@
+import pytest
+
+from conftest import crm
+
+
+def schema_version():
+    with crm.get_db() as conn:
+        return crm.get_schema_version(conn)
+
+
+def status_history(shipment_id):
+    with crm.get_db() as conn:
+        return [
+            (row["status_code"], row["status"], row["timestamp"])
+            for row in conn.execute(
+                """
+                SELECT status_code, status, timestamp FROM shipment_status_history
+                WHERE shipment_id = ? ORDER BY timestamp
+                """,
+                (shipment_id,),
+            )
+        ]
+
+
+def add_shipment(conn):
+    return conn.execute(
+        """
+        INSERT INTO shipments
+        (origin_label, destination_label, internal_number, display_number, created_at)
+        VALUES ('Склад', 'Магазин', '1', '1', '2024-01-01T00:00:00')
+        """
+    ).lastrowid
+
+
+def test_fresh_database_reaches_latest_version(db):
+    assert schema_version() == crm.MIGRATIONS[-1][0]
+    assert [number for number, _ in crm.MIGRATIONS] == list(
+        range(1, len(crm.MIGRATIONS) + 1)
+    )
+
+
+def test_init_db_is_idempotent(db):
+    with crm.get_db() as conn:
+        before = conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY name").fetchall()
+    crm.init_db()
+    with crm.get_db() as conn:
+        after = conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY name").fetchall()
+    assert [tuple(row) for row in after] == [tuple(row) for row in before]
+    assert schema_version() == crm.MIGRATIONS[-1][0]
+
+
+def test_legacy_status_history_keeps_real_codes(db):
+    with crm.get_db() as conn:
+        conn.execute("DROP VIEW shipment_status_history")
+        conn.execute(
+            """
+            CREATE TABLE shipment_status_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                shipment_id INTEGER NOT NULL,
+                status TEXT,
+                location TEXT,
+                status_code TEXT,
+                timestamp TEXT
+            )
+            """
+        )
+        shipment_id = add_shipment(conn)
+        conn.executemany(
+            "INSERT INTO shipment_status_history (shipment_id, status, timestamp) VALUES (?, ?, ?)",
+            [
+                (shipment_id, "Создан", "2024-01-01T00:00:00"),
+                (shipment_id, "Неизвестный статус", "2024-01-02T00:00:00"),
+            ],
+        )
+        conn.execute("PRAGMA user_version = 4")
+    crm.init_db()
+
+    with crm.get_db() as conn:
+        crm.record_cdek_status_history(
+            conn,
+            shipment_id,
+            [{"code": "CREATED", "status": "Создан", "timestamp": "2024-01-01T00:00:00"}],
+        )
+    assert status_history(shipment_id) == [
+        ("CREATED", "Создан", "2024-01-01T00:00:00"),
+        ("Неизвестный статус", "Неизвестный статус", "2024-01-02T00:00:00"),
+    ]
+
+
+def test_name_coded_statuses_are_merged_into_codes(db):
+    with crm.get_db() as conn:
+        shipment_id = add_shipment(conn)
+        legacy_id = conn.execute(
+            "INSERT INTO cdek_status_codes (code, name) VALUES ('Вручен', 'Вручен')"
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO shipment_status_events (shipment_id, timestamp, status_id) VALUES (?, ?, ?)",
+            [
+                (shipment_id, "2024-01-05T00:00:00", legacy_id),
+                (shipment_id, "2024-01-06T00:00:00", legacy_id),
+            ],
+        )
+        crm.record_cdek_status_history(
+            conn,
+            shipment_id,
+            [{"code": "DELIVERED", "status": "Вручен", "timestamp": "2024-01-05T00:00:00"}],
+        )
+        conn.execute("PRAGMA user_version = 14")
+    crm.init_db()
+
+    assert status_history(shipment_id) == [
+        ("DELIVERED", "Вручен", "2024-01-05T00:00:00"),
+        ("DELIVERED", "Вручен", "2024-01-06T00:00:00"),
+    ]
+    with crm.get_db() as conn:
+        assert conn.execute(
+            "SELECT COUNT(*) FROM cdek_status_codes WHERE code = 'Вручен'"
+        ).fetchone()[0] == 0
+
+
+def test_sales_date_fix_rewrites_bad_dates_and_rollups(db):
+    with crm.get_db() as conn:
+        location_id = conn.execute(
+            "INSERT INTO locations (name, created_at) VALUES ('A', '2024-01-01T00:00:00')"
+        ).lastrowid
+        product_id = conn.execute(
+            """
+            INSERT INTO products (product_key, display_name, created_at)
+            VALUES ('x', 'x', '2024-01-01T00:00:00')
+            """
+        ).lastrowid
+        conn.executemany(
+            """
+            INSERT INTO records
+            (location_id, product_id, sales_qty, sales_amount, record_date, created_at, sales_date)
+            VALUES (?, ?, 1, 10, ?, '2024-03-10T12:00:00', ?)
+            """,
+            [
+                (location_id, product_id, "2024-02-30", "2024-03-01"),
+                (location_id, product_id, "05.03.2024", "2024-03-05"),
+            ],
+        )
+        crm.rebuild_sales_rollups(conn)
+        conn.execute("PRAGMA user_version = 13")
+    crm.init_db()
+
+    with crm.get_db() as conn:
+        dates = [row[0] for row in conn.execute("SELECT sales_date FROM records ORDER BY id")]
+        days = conn.execute(
+            "SELECT period, sales_qty FROM sales_rollups WHERE grain = 'day' ORDER BY period"
+        ).fetchall()
+    assert dates == ["2024-03-10", "2024-03-05"]
+    assert [tuple(row) for row in days] == [("2024-03-05", 1), ("2024-03-10", 1)]
+
+
+@pytest.mark.parametrize(
+    "record_date",
+    [
+        "2024-03-05",
+        " 2024-03-05 ",
+        "2024-03-05T10:00:00",
+        "05.03.2024",
+        "05.03.2024 10:00",
+        "2024-02-30",
+        "31.02.2024",
+        "0000-01-01",
+        "45000",
+        "",
+        None,
+    ],
+)
+def test_sales_date_sql_matches_python(db, record_date):
+    created_at = "2024-03-10T12:00:00"
+    with crm.get_db() as conn:
+        in_sql = conn.execute(
+            f"SELECT {crm.SALES_DATE_SQL} FROM (SELECT ? AS record_date, ? AS created_at)",
+            (record_date, created_at),
+        ).fetchone()[0]
+    assert in_sql == crm.parse_sales_dates([record_date], created_at)[0]